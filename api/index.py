@@ -1,78 +1,344 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify
 import sys
 import os
 import io
+import time
+import hashlib
+import tempfile
 
 # Add the parent directory to sys.path to allow importing lib
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from lib.cifra_logic import get_cifra_content, generate_pdf_bytes, generate_docx_bytes
+from lib.cifra_logic import (
+    load_cifra, render_song, generate_document, safe_filename, split_song_url, song_to_bytes,
+    transpose_song,
+    RENDERERS, MIMETYPES, PREVIEW_FORMATS, song_cache_stats, render_cache_stats, coalescing_stats,
+    start_render_pool,
+)
+from lib.fetcher import stats as fetch_stats
+from lib.metrics import registry, start_request, finish_request, observe_output, with_hit_ratio
+from lib.jobs import build_job_queue, is_main_process, QueueFull, DONE, FAILED
+from lib.library import open_library, DEFAULT_SEARCH_LIMIT
+from lib.warmup import open_request_log, start_warmup_thread
+from lib.cache import normalize_song_url
+from lib.songbook import (
+    parse_setlist_line, load_songs, render_songbook, SONGBOOK_FORMATS, DEFAULT_SONGBOOK_TITLE,
+)
+
+MAX_SONGBOOK_SONGS = 30
+
+# Songbooks are rendered into a spooled file that moves to disk past this
+# size and is streamed back in chunks, instead of being held in memory as
+# bytes and then copied into the response.
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+# Longest a status request may block waiting for its job (?wait=seconds),
+# kept under the 30s maxDuration of the Vercel function.
+MAX_JOB_WAIT = 25
+
+MAX_SEARCH_LIMIT = 100
+
+jobs = None
+library = None
+request_log = None
+
+# Spawned render workers re-import this module; only the serving process
+# sets up queues, pools and background threads.
+if is_main_process():
+    jobs = build_job_queue()
+
+    # No-op unless CIFRA_EXECUTOR=process
+    start_render_pool()
+
+    # Song index behind /api/search; None unless CIFRA_LIBRARY is set
+    library = open_library()
+
+    # Popularity data for the warm-up; None unless CIFRA_REQUEST_LOG is set
+    request_log = open_request_log()
+
+    # Pre-renders popular songs in the background when CIFRA_WARMUP_INTERVAL is set
+    start_warmup_thread()
+
+# Generated documents may be kept by the edge for this long; browsers
+# always revalidate and get a 304 while the ETag still matches.
+EDGE_MAX_AGE = 3600
 
 app = Flask(__name__)
 
-@app.route('/api/generate', methods=['POST'])
+@app.before_request
+def start_timing():
+    start_request()
+
+@app.after_request
+def add_server_timing(response):
+    timer = finish_request()
+    if timer is not None:
+        # Per-stage durations (fetch, parse, transpose, layout, render) for the browser devtools
+        response.headers['Server-Timing'] = timer.server_timing()
+        registry.observe(f"request.{request.endpoint}", timer.elapsed_ms())
+        registry.increment(f"status.{response.status_code}")
+    return response
+
+def send_document(filename, format_type, document):
+    observe_output(format_type, len(document.data))
+    response = send_file(
+        io.BytesIO(document.data),
+        mimetype=MIMETYPES[format_type],
+        as_attachment=True,
+        download_name=f"{filename}.{format_type}",
+        etag=document.etag,
+        conditional=True,
+    )
+    response.headers['Cache-Control'] = f"public, max-age=0, must-revalidate, s-maxage={EDGE_MAX_AGE}"
+    return response
+
+def job_status(job):
+    status = job.to_dict()
+    status['status_url'] = f"/api/jobs/{job.id}"
+    if job.status == DONE:
+        status['result_url'] = f"/api/jobs/{job.id}/result"
+    return status
+
+@app.route('/api/generate', methods=['GET', 'POST'])
 def generate():
-    data = request.json
+    # GET (query string) responses can be cached and revalidated by the
+    # browser and the edge; POST with a JSON body is kept for old clients.
+    data = request.args if request.method == 'GET' else request.json
     try:
         print(f"Received request data: {str(data).encode('utf-8', errors='ignore')}", file=sys.stderr)
     except:
         pass
         
     url = data.get('url')
-    format_type = data.get('format', 'pdf') # pdf or docx
+    format_type = data.get('format', 'pdf') # pdf, docx or zip (both)
+    # async: answer 202 with a job id right away and render in the background;
+    # POST clients may pass it in the JSON body or as ?async=1
+    run_async = str(data.get('async', request.args.get('async', ''))).lower() in ('1', 'true')
     
     if not url:
         return jsonify({"error": "URL is required"}), 400
         
-    # Strip fragment (e.g. #google_vignette=true)
-    target_key_index = None
-    if '#' in url:
-        parts = url.split('#')
-        url = parts[0]
-        fragment = parts[1]
-        # Parse key=value from fragment
-        for param in fragment.split('&'):
-            if param.startswith('key='):
-                try:
-                    target_key_index = int(param.split('=')[1])
-                    print(f"DEBUG: Extracted key index from URL: {target_key_index}", file=sys.stderr)
-                except:
-                    pass
-
+    if format_type not in RENDERERS and format_type != 'zip':
+        return jsonify({"error": "Invalid format"}), 400
+        
+    # Strip fragment (e.g. #google_vignette=true) and read the key index
+    url, target_key_index = split_song_url(url)
+    if target_key_index is not None:
+        print(f"DEBUG: Extracted key index from URL: {target_key_index}", file=sys.stderr)
+        
+    if run_async:
+        try:
+            job = jobs.submit(generate_document, url, target_key_index, format_type, info={'format': format_type})
+        except QueueFull as e:
+            return jsonify({"error": str(e)}), 503, {'Retry-After': '5'}
+        if request_log is not None:
+            request_log.record(url, target_key_index, format_type)
+        return jsonify(job_status(job)), 202, {'Location': f"/api/jobs/{job.id}"}
         
     try:
         print(f"Processing URL: {url} with key index: {target_key_index}", file=sys.stderr)
-        title, artist, key, lines = get_cifra_content(url, target_key_index)
+        filename, document = generate_document(url, target_key_index, format_type)
+        if library is not None:
+            # Already in the song cache; only written when the page changed
+            try:
+                library.add_song(normalize_song_url(url), load_cifra(url))
+            except Exception as e:
+                print(f"Error indexing {url}: {e}", file=sys.stderr)
+        response = send_document(filename, format_type, document)
+        # Revalidations (304) are the same client again, not new demand
+        if request_log is not None and response.status_code != 304:
+            request_log.record(url, target_key_index, format_type)
+        return response
+        
+    except Exception as e:
+        print(f"Error processing request: {e}", file=sys.stderr)
+        import traceback
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/preview', methods=['GET'])
+def preview():
+    """Reflowed chart as html (default), json or txt, shown inline."""
+    url = request.args.get('url')
+    format_type = request.args.get('format', 'html')
+    
+    if not url:
+        return jsonify({"error": "URL is required"}), 400
+    if format_type not in PREVIEW_FORMATS:
+        return jsonify({"error": "Invalid format"}), 400
         
-        # Sanitize filename
-        safe_title = "".join([c for c in title if c.isalpha() or c.isdigit() or c==' ']).rstrip()
-        safe_artist = "".join([c for c in artist if c.isalpha() or c.isdigit() or c==' ']).rstrip()
-        filename = f"{safe_title}_{safe_artist}".replace(" ", "_")
+    url, target_key_index = split_song_url(url)
+    key = request.args.get('key')
+    if key is not None:
+        try:
+            target_key_index = int(key)
+        except ValueError:
+            return jsonify({"error": "Invalid key"}), 400
+            
+    try:
+        document = render_song(load_cifra(url), target_key_index, format_type)
+        response = Response(document.data, mimetype=MIMETYPES[format_type])
+        response.set_etag(document.etag)
+        response.headers['Cache-Control'] = f"public, max-age=0, must-revalidate, s-maxage={EDGE_MAX_AGE}"
+        return response.make_conditional(request)
+        
+    except Exception as e:
+        print(f"Error processing preview: {e}", file=sys.stderr)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/song', methods=['GET'])
+def song():
+    """Parsed song (optionally transposed) in the lib.songpack binary format."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({"error": "URL is required"}), 400
         
-        if format_type == 'pdf':
-            pdf_bytes = generate_pdf_bytes(title, artist, key, lines)
-            return send_file(
-                io.BytesIO(pdf_bytes),
-                mimetype='application/pdf',
-                as_attachment=True,
-                download_name=f"{filename}.pdf"
-            )
-        elif format_type == 'docx':
-            docx_bytes = generate_docx_bytes(title, artist, key, lines)
-            return send_file(
-                io.BytesIO(docx_bytes),
-                mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                as_attachment=True,
-                download_name=f"{filename}.docx"
-            )
-        else:
-            return jsonify({"error": "Invalid format"}), 400
+    url, target_key_index = split_song_url(url)
+    key = request.args.get('key')
+    if key is not None:
+        try:
+            target_key_index = int(key)
+        except ValueError:
+            return jsonify({"error": "Invalid key"}), 400
             
+    try:
+        data = song_to_bytes(transpose_song(load_cifra(url), target_key_index))
+        observe_output('song', len(data))
+        response = Response(data, mimetype=MIMETYPES['song'])
+        response.set_etag(hashlib.sha256(data).hexdigest())
+        response.headers['Cache-Control'] = f"public, max-age=0, must-revalidate, s-maxage={EDGE_MAX_AGE}"
+        return response.make_conditional(request)
+        
     except Exception as e:
-        print(f"Error processing request: {e}", file=sys.stderr)
+        print(f"Error processing song: {e}", file=sys.stderr)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/songbook', methods=['POST'])
+def songbook():
+    data = request.json or {}
+    songs = data.get('songs') or []
+    format_type = data.get('format', 'pdf')
+    title = data.get('title') or DEFAULT_SONGBOOK_TITLE
+    
+    if not songs:
+        return jsonify({"error": "At least one song is required"}), 400
+    if len(songs) > MAX_SONGBOOK_SONGS:
+        return jsonify({"error": f"At most {MAX_SONGBOOK_SONGS} songs per songbook"}), 400
+    if format_type not in SONGBOOK_FORMATS:
+        return jsonify({"error": "Invalid format"}), 400
+        
+    try:
+        entries = []
+        for song in songs:
+            # Either "url [key]" strings (setlist syntax) or {"url": ..., "key": ...}
+            if isinstance(song, dict):
+                line = song.get('url', '')
+                if song.get('key') is not None:
+                    line = f"{line} | {song['key']}"
+            else:
+                line = str(song)
+            entry = parse_setlist_line(line)
+            # Only remote songs here: setlist paths would read server files
+            if entry is None or not entry.source.startswith(('http://', 'https://')):
+                return jsonify({"error": f"Invalid song URL: {line}"}), 400
+            entries.append(entry)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+        
+    try:
+        print(f"Building songbook with {len(entries)} songs", file=sys.stderr)
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        try:
+            render_songbook(load_songs(entries), format_type, title, output)
+        except Exception:
+            output.close()
+            raise
+        size = output.tell()
+        observe_output(f"songbook_{format_type}", size)
+        output.seek(0)
+        filename = safe_filename(title, "").rstrip("_") or "Repertorio"
+        # send_file closes the file once the response has been sent
+        response = send_file(
+            output,
+            mimetype=MIMETYPES[format_type],
+            as_attachment=True,
+            download_name=f"{filename}.{format_type}"
+        )
+        response.content_length = size
+        return response
+        
+    except Exception as e:
+        print(f"Error processing songbook: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc(file=sys.stderr)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status; ?wait=N long-polls up to N seconds for it to finish."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    try:
+        timeout = min(float(request.args.get('wait', 0)), MAX_JOB_WAIT)
+    except ValueError:
+        return jsonify({"error": "Invalid wait"}), 400
+    if timeout > 0:
+        job.wait(timeout)
+    return jsonify(job_status(job))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    status = job.status
+    if status == FAILED:
+        return jsonify(job_status(job)), 500
+    if status != DONE:
+        return jsonify(job_status(job)), 409
+    filename, document = job.result
+    return send_document(filename, job.info['format'], document)
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Library search: ?q=words&progression=I V vi IV&key=G&limit=20"""
+    if library is None:
+        return jsonify({"error": "Library not configured"}), 503
+    try:
+        limit = int(request.args.get('limit', DEFAULT_SEARCH_LIMIT))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    # SQLite reads a negative LIMIT as "no limit"
+    if limit < 1:
+        return jsonify({"error": "Invalid limit"}), 400
+    limit = min(limit, MAX_SEARCH_LIMIT)
+        
+    start = time.perf_counter()
+    try:
+        results = library.search(
+            request.args.get('q', ''),
+            progression=request.args.get('progression'),
+            key=request.args.get('key'),
+            limit=limit,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    took_ms = (time.perf_counter() - start) * 1000
+    return jsonify({
+        "results": [result._asdict() for result in results],
+        "took_ms": round(took_ms, 3),
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    snapshot = registry.snapshot()
+    snapshot['song_cache'] = with_hit_ratio(song_cache_stats())
+    snapshot['render_cache'] = with_hit_ratio({'memory': render_cache_stats()})
+    snapshot['fetch'] = dict(fetch_stats)
+    snapshot['jobs'] = jobs.stats()
+    snapshot['coalescing'] = coalescing_stats()
+    return jsonify(snapshot)
+
 if __name__ == '__main__':
     app.run(port=5328)
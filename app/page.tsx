@@ -2,11 +2,56 @@
 
 import { useState } from 'react';
 
+// Cifra Club key indexes (the #key=N of its links), starting at A
+const KEYS = ['A', 'A#', 'B', 'C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#'];
+
+type Preview = {
+  title: string;
+  artist: string;
+  key: string;
+  font_size: number;
+  rows: [string, boolean, boolean][][];
+};
+
 export default function Home() {
   const [url, setUrl] = useState('');
   const [format, setFormat] = useState('pdf');
+  const [key, setKey] = useState('');
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const [preview, setPreview] = useState<Preview | null>(null);
+  const [previewLoading, setPreviewLoading] = useState(false);
+
+  // The key travels in the fragment, like on Cifra Club links
+  const songUrl = (targetKey: string) =>
+    targetKey === '' ? url : `${url.split('#')[0]}#key=${targetKey}`;
+
+  const loadPreview = async (targetKey: string) => {
+    if (!url) return;
+    setPreviewLoading(true);
+    setError('');
+
+    try {
+      const params = new URLSearchParams({ url: songUrl(targetKey), format: 'json' });
+      const response = await fetch(`/api/preview?${params}`);
+      const data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.error || 'Erro ao gerar prévia');
+      }
+      setPreview(data);
+    } catch (err: any) {
+      setError(err.message);
+    } finally {
+      setPreviewLoading(false);
+    }
+  };
+
+  const handleKeyChange = (targetKey: string) => {
+    setKey(targetKey);
+    if (preview) {
+      loadPreview(targetKey);
+    }
+  };
 
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -14,13 +59,9 @@ export default function Home() {
     setError('');
 
     try {
-      const response = await fetch('/api/generate', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ url, format }),
-      });
+      // GET so the browser cache can revalidate the document with its ETag
+      const params = new URLSearchParams({ url: songUrl(key), format });
+      const response = await fetch(`/api/generate?${params}`);
 
       if (!response.ok) {
         const data = await response.json();
@@ -89,7 +130,7 @@ export default function Home() {
             <label className="block text-lg font-medium text-gray-300">
               Formato de Saída
             </label>
-            <div className="grid grid-cols-2 gap-4">
+            <div className="grid grid-cols-3 gap-4">
               <label className={`flex items-center justify-center p-4 rounded-xl border-2 cursor-pointer transition-all ${format === 'pdf' ? 'border-orange-500 bg-orange-500/10' : 'border-gray-600 bg-gray-900/50 hover:border-gray-500'}`}>
                 <input
                   type="radio"
@@ -110,9 +151,36 @@ export default function Home() {
                 />
                 <span className={`text-lg font-bold ${format === 'docx' ? 'text-blue-400' : 'text-gray-400'}`}>DOCX</span>
               </label>
+              <label className={`flex items-center justify-center p-4 rounded-xl border-2 cursor-pointer transition-all ${format === 'zip' ? 'border-green-500 bg-green-500/10' : 'border-gray-600 bg-gray-900/50 hover:border-gray-500'}`}>
+                <input
+                  type="radio"
+                  value="zip"
+                  checked={format === 'zip'}
+                  onChange={(e) => setFormat(e.target.value)}
+                  className="hidden"
+                />
+                <span className={`text-lg font-bold ${format === 'zip' ? 'text-green-400' : 'text-gray-400'}`}>Ambos</span>
+              </label>
             </div>
           </div>
 
+          <div className="space-y-3">
+            <label htmlFor="key" className="block text-lg font-medium text-gray-300">
+              Tom
+            </label>
+            <select
+              id="key"
+              value={key}
+              onChange={(e) => handleKeyChange(e.target.value)}
+              className="w-full px-4 py-4 bg-gray-900/80 border border-gray-600 rounded-xl focus:ring-2 focus:ring-orange-500 outline-none text-lg text-white"
+            >
+              <option value="">Original</option>
+              {KEYS.map((name, index) => (
+                <option key={name} value={index}>{name}</option>
+              ))}
+            </select>
+          </div>
+
           {error && (
             <div className="p-4 bg-red-900/30 border border-red-800 text-red-200 text-base rounded-xl flex items-center">
               <svg className="w-6 h-6 mr-3 flex-shrink-0" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -139,7 +207,33 @@ export default function Home() {
               'Gerar Arquivo'
             )}
           </button>
+
+          <button
+            type="button"
+            disabled={previewLoading || !url}
+            onClick={() => loadPreview(key)}
+            className="w-full border-2 border-gray-600 hover:border-gray-500 text-gray-300 font-bold py-3 px-6 rounded-xl transition-all disabled:opacity-50 disabled:cursor-not-allowed text-lg"
+          >
+            {previewLoading ? 'Carregando prévia...' : 'Pré-visualizar'}
+          </button>
         </form>
+
+        {preview && (
+          <div className="mt-8 bg-white text-black rounded-xl p-4 overflow-x-auto">
+            <h2 className="text-center font-bold underline">{preview.title}</h2>
+            <h3 className="text-center text-sm mb-2">{preview.artist}</h3>
+            <pre className="font-mono text-xs leading-snug">
+              {preview.rows.map((row, rowIndex) => (
+                <div key={rowIndex}>
+                  {row.map(([text, bold, italic], index) => (
+                    <span key={index} className={`${bold ? 'font-bold' : ''} ${italic ? 'italic' : ''}`}>{text}</span>
+                  ))}
+                  {row.length === 0 && ' '}
+                </div>
+              ))}
+            </pre>
+          </div>
+        )}
         
         <p className="mt-8 text-center text-sm text-gray-500">
           Cole o link de uma cifra do Cifra Club para gerar uma versão formatada em uma única página.
@@ -0,0 +1,93 @@
+"""Cold-start import budget for the API module.
+
+Imports api.index in fresh interpreters, reports the median import time
+and the slowest modules (python -X importtime), and checks that none of
+the lazily loaded dependencies got imported at startup.
+
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --budget-ms 300 --repeat 10
+
+Exits with status 1 when the median is over budget or a lazy dependency
+was imported, so it can gate a change.
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must only be imported by the code paths that use them
+LAZY_MODULES = ('bs4', 'fpdf', 'requests')
+
+DEFAULT_BUDGET_MS = 250
+
+_PROBE = (
+    "import sys, time, json\n"
+    "sys.path.insert(0, {root!r})\n"
+    "start = time.perf_counter()\n"
+    "import api.index\n"
+    "elapsed = (time.perf_counter() - start) * 1000\n"
+    "loaded = [m for m in {lazy!r} if m in sys.modules]\n"
+    "print(json.dumps([elapsed, loaded]))\n"
+)
+
+def measure_once():
+    import json
+    code = _PROBE.format(root=ROOT, lazy=LAZY_MODULES)
+    output = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=ROOT,
+    ).stdout
+    elapsed, loaded = json.loads(output.strip().splitlines()[-1])
+    return elapsed, loaded
+
+def slowest_modules(count):
+    """(cumulative ms, module) for the top-level imports of api.index."""
+    code = f"import sys; sys.path.insert(0, {ROOT!r}); import api.index"
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, cwd=ROOT,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Two-space indentation per nesting level; keep direct imports only
+        if len(name) - len(name.lstrip()) <= 3:
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Mede o tempo de importação da API (cold start).")
+    parser.add_argument('--repeat', type=int, default=5, help="interpretadores novos a medir (padrão: 5)")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help=f"limite da mediana em ms (padrão: {DEFAULT_BUDGET_MS})")
+    parser.add_argument('--top', type=int, default=10, help="módulos mais lentos a listar (padrão: 10)")
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    timings = []
+    loaded = set()
+    for _ in range(args.repeat):
+        elapsed, modules = measure_once()
+        timings.append(elapsed)
+        loaded.update(modules)
+
+    median = statistics.median(timings)
+    print(f"import api.index: mediana {median:.1f} ms, mín {min(timings):.1f} ms (orçamento {args.budget_ms:.0f} ms)")
+    print("\nImportações mais lentas (acumulado):")
+    for cumulative, name in slowest_modules(args.top):
+        print(f"  {cumulative:>8.1f} ms  {name}")
+
+    failed = False
+    if loaded:
+        print(f"\nDependências que deveriam ser carregadas sob demanda: {', '.join(sorted(loaded))}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"\nAcima do orçamento: {median:.1f} ms > {args.budget_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,153 @@
+"""Offline benchmarks for the parse -> transpose -> layout -> render pipeline.
+
+Runs every stage against the saved pages in benchmarks/fixtures and
+reports median/min time, throughput and peak memory (tracemalloc) per
+stage. No network access is needed.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --fixture long --stage layout --repeat 50
+    python benchmarks/run_benchmarks.py --json results.json
+    python benchmarks/run_benchmarks.py --compare results.json --tolerance 0.25
+    python benchmarks/run_benchmarks.py --save https://www.cifraclub.com.br/artista/musica/ nome
+
+--compare exits with status 1 when a stage's median is slower than the
+baseline by more than the tolerance, so it can gate a change.
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import statistics
+import tracemalloc
+from contextlib import redirect_stderr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.cifra_logic import (
+    parse_cifra_html, parse_cifra_html_soup, transpose_song, layout_song, render_pdf, render_docx,
+)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def _transpose_all_keys(song):
+    for key_index in range(12):
+        transpose_song(song, key_index)
+
+# name -> (function building the stage input from the fixture context, stage callable)
+STAGES = {
+    'parse': lambda ctx: parse_cifra_html(ctx['html']),
+    'parse_soup': lambda ctx: parse_cifra_html_soup(ctx['html']),
+    'transpose_12_keys': lambda ctx: _transpose_all_keys(ctx['song']),
+    'layout': lambda ctx: layout_song(*ctx['song']),
+    'render_pdf': lambda ctx: render_pdf(ctx['layout']),
+    'render_docx': lambda ctx: render_docx(ctx['layout']),
+}
+
+def list_fixtures():
+    return sorted(name[:-5] for name in os.listdir(FIXTURES_DIR) if name.endswith('.html'))
+
+def load_context(name):
+    with open(os.path.join(FIXTURES_DIR, f'{name}.html'), 'rb') as f:
+        html = f.read()
+    with redirect_stderr(io.StringIO()):
+        song = parse_cifra_html(html)
+        layout = layout_song(*song)
+    return {'html': html, 'song': song, 'layout': layout}
+
+def measure(stage, ctx, repeat):
+    # Debug prints to stderr would otherwise dominate the cheap stages
+    with redirect_stderr(io.StringIO()):
+        stage(ctx)  # warm-up
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            stage(ctx)
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        stage(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        'median_ms': median * 1000,
+        'min_ms': min(timings) * 1000,
+        'ops_per_sec': 1 / median if median else float('inf'),
+        'peak_kb': peak / 1024,
+    }
+
+def run(fixtures, stages, repeat):
+    results = {}
+    for fixture in fixtures:
+        ctx = load_context(fixture)
+        for stage_name in stages:
+            results[f'{fixture}/{stage_name}'] = measure(STAGES[stage_name], ctx, repeat)
+    return results
+
+def print_table(results, baseline=None):
+    header = f"{'fixture/stage':<34}{'median ms':>11}{'min ms':>10}{'ops/s':>10}{'peak KB':>10}"
+    if baseline:
+        header += f"{'vs base':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        row = f"{name:<34}{r['median_ms']:>11.3f}{r['min_ms']:>10.3f}{r['ops_per_sec']:>10.1f}{r['peak_kb']:>10.1f}"
+        if baseline and name in baseline:
+            row += f"{r['median_ms'] / baseline[name]['median_ms']:>8.2f}x"
+        print(row)
+
+def regressions(results, baseline, tolerance):
+    return [
+        name for name, r in results.items()
+        if name in baseline and r['median_ms'] > baseline[name]['median_ms'] * (1 + tolerance)
+    ]
+
+def save_fixture(url, name):
+    from lib.fetcher import fetch
+    path = os.path.join(FIXTURES_DIR, f'{name}.html')
+    with open(path, 'wb') as f:
+        f.write(fetch(url).content)
+    print(f"Fixture salva: {path}")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks offline do pipeline de cifras.")
+    parser.add_argument('--fixture', action='append', choices=list_fixtures(), help="fixture a medir (repetível; padrão: todas)")
+    parser.add_argument('--stage', action='append', choices=list(STAGES), help="etapa a medir (repetível; padrão: todas)")
+    parser.add_argument('--repeat', type=int, default=20, help="execuções por etapa (padrão: 20)")
+    parser.add_argument('--json', metavar='ARQUIVO', help="salva os resultados em JSON")
+    parser.add_argument('--compare', metavar='ARQUIVO', help="compara com resultados salvos com --json")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="piora relativa aceita com --compare (padrão: 0.25)")
+    parser.add_argument('--save', nargs=2, metavar=('URL', 'NOME'), help="baixa uma página como nova fixture e sai")
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    if args.save:
+        save_fixture(*args.save)
+        return 0
+
+    results = run(args.fixture or list_fixtures(), args.stage or list(STAGES), args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        slower = regressions(results, baseline, args.tolerance)
+        if slower:
+            print(f"\nRegressões acima de {args.tolerance:.0%}: {', '.join(slower)}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,42 +1,181 @@
 import sys
 import os
-from lib.cifra_logic import get_cifra_content, get_content_from_file, generate_pdf_bytes, generate_docx_bytes
+import argparse
+from lib.cifra_logic import (
+    get_cifra_content, get_content_from_file, iter_songs, iter_songs_from_file, layout_song, render, render_zip,
+    safe_filename,
+)
+from lib.songbook import read_setlist, load_songs, render_songbook, SONGBOOK_FORMATS, DEFAULT_SONGBOOK_TITLE
+from lib.library import open_library
+from lib.batch import convert_directory
+from lib.warmup import read_popularity_list, popular_targets, warm, warm_remote, DEFAULT_WARM_TOP
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
+DEFAULT_LIBRARY = "biblioteca.sqlite3"
+
+DEFAULT_URL = "https://www.cifraclub.com.br/isaias-saad/bondade-de-deus/"
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Gera PDF e DOCX formatados a partir de uma cifra do Cifra Club ou de um arquivo .txt.")
+    parser.add_argument('entrada', nargs='?', help="URL do Cifra Club, arquivo .txt ou pasta com arquivos .txt")
+    parser.add_argument('--zip', action='store_true', help="gera um único .zip com o PDF e o DOCX")
+    parser.add_argument('--repertorio', metavar='ARQUIVO', help="arquivo com uma URL ou .txt por linha (tom opcional) para gerar um único documento")
+    parser.add_argument('--formato', choices=SONGBOOK_FORMATS, help="formato do repertório (padrão: pdf) ou o único formato gerado de uma pasta (padrão: pdf e docx)")
+    parser.add_argument('--titulo', default=DEFAULT_SONGBOOK_TITLE, help="título do repertório")
+    parser.add_argument('--varias', action='store_true', help="o .txt (ou - para a entrada padrão) tem várias músicas separadas por --- ou ===; gera os documentos de cada uma")
+    parser.add_argument('--marcador', metavar='TEXTO', help='com --varias, linhas que começam com TEXTO (ex.: "Título:") abrem uma nova música')
+    parser.add_argument('--saida', metavar='PASTA', help="pasta dos documentos gerados de uma pasta (padrão: a própria pasta)")
+    parser.add_argument('--processos', type=int, help="processos usados para converter uma pasta (padrão: núcleos da CPU)")
+    parser.add_argument('--forcar', action='store_true', help="converte de novo todas as cifras da pasta, mesmo as sem mudança")
+    parser.add_argument('--aquecer', metavar='LISTA', help="pré-carrega as músicas da lista (uma URL e tom opcional por linha) nos formatos de --formato")
+    parser.add_argument('--aquecer-log', metavar='LOG', help="pré-carrega as músicas mais pedidas do log de requisições (CIFRA_REQUEST_LOG)")
+    parser.add_argument('--top', type=int, default=DEFAULT_WARM_TOP, help=f"quantos documentos do log pré-carregar (padrão: {DEFAULT_WARM_TOP})")
+    parser.add_argument('--servidor', metavar='URL', help="aquece uma API em execução (e o cache da borda) em vez do cache local")
+    parser.add_argument('--biblioteca', metavar='ARQUIVO', help=f"índice de músicas (padrão: CIFRA_LIBRARY ou {DEFAULT_LIBRARY})")
+    parser.add_argument('--indexar', metavar='PASTA', help="indexa os .txt da pasta na biblioteca (só os alterados)")
+    parser.add_argument('--buscar', metavar='TEXTO', help="busca na biblioteca por título, artista ou letra")
+    parser.add_argument('--progressao', metavar='GRAUS', help='filtra a busca por progressão, ex.: "I V vi IV"')
+    parser.add_argument('--tom', help="filtra a busca pelo tom, ex.: G ou Em")
+    return parser.parse_args(argv)
+
+def convert_single(entrada):
+    if not entrada:
         print("Uso: python cifra_formatter.py <URL ou Arquivo.txt>")
-        url = "https://www.cifraclub.com.br/isaias-saad/bondade-de-deus/"
+        url = DEFAULT_URL
         print(f"Usando URL padrão: {url}")
     else:
-        url = sys.argv[1]
+        url = entrada
         if '#' in url:
             url = url.split('#')[0]
 
     print(f"Processando: {url}")
-    
+
+    if os.path.isfile(url):
+        title, artist, key, lines = get_content_from_file(url)
+    else:
+        title, artist, key, lines = get_cifra_content(url)
+
+    base_filename = safe_filename(title, artist)
+
+    # One layout pass feeds both documents
+    layout = layout_song(title, artist, key, lines)
+    return base_filename, layout
+
+def build_songbook(setlist_path, format_type, title):
+    entries = read_setlist(setlist_path)
+    if not entries:
+        raise Exception("O repertório está vazio.")
+    print(f"Carregando {len(entries)} músicas...")
+    songs = load_songs(entries)
+
+    filename = f"{safe_filename(title, '').rstrip('_') or 'Repertorio'}.{format_type}"
+    with open(filename, "wb") as f:
+        render_songbook(songs, format_type, title, f)
+    print(f"Repertório gerado com sucesso: {filename}")
+
+def convert_folder(args):
+    formats = [args.formato] if args.formato else ['pdf', 'docx']
+    print(f"Processando pasta: {args.entrada}")
+    stats = convert_directory(args.entrada, args.saida, formats, args.processos, args.forcar)
+    print(f"Concluído em {stats.elapsed:.1f}s: {stats.converted} convertidas, "
+          f"{stats.skipped} sem mudança, {stats.failed} com erro")
+    if stats.failed:
+        sys.exit(1)
+
+def convert_many(args):
+    """Render each song of a concatenated export as soon as it is read."""
+    formats = [args.formato] if args.formato else ['pdf', 'docx']
+    if args.entrada == '-':
+        songs = iter_songs(sys.stdin, args.marcador)
+    else:
+        songs = iter_songs_from_file(args.entrada, args.marcador)
+    output_dir = args.saida or '.'
+    os.makedirs(output_dir, exist_ok=True)
+
+    used_names = {}
+    count = 0
+    for count, song in enumerate(songs, 1):
+        base_filename = safe_filename(song.title, song.artist)
+        # Songbooks repeat songs (and exports lose titles); never overwrite
+        used_names[base_filename] = used_names.get(base_filename, 0) + 1
+        if used_names[base_filename] > 1:
+            base_filename = f"{base_filename}_{used_names[base_filename]}"
+        layout = layout_song(*song)
+        for format_type in formats:
+            with open(os.path.join(output_dir, f"{base_filename}.{format_type}"), "wb") as f:
+                render(layout, format_type, f)
+        print(f"[{count}] {song.title} - {song.artist}")
+    print(f"{count} músicas convertidas.")
+
+def warm_caches(args):
+    targets = []
+    if args.aquecer:
+        targets.extend(read_popularity_list(args.aquecer, [args.formato or 'pdf']))
+    if args.aquecer_log:
+        targets.extend(popular_targets(args.aquecer_log, args.top))
+    targets = list(dict.fromkeys(targets))
+    print(f"Aquecendo {len(targets)} documentos...")
+    if args.servidor:
+        stats = warm_remote(targets, args.servidor, progress=print)
+    else:
+        # Only the disk song cache (CIFRA_CACHE_DIR) outlives this process
+        stats = warm(targets, progress=print)
+    print(f"Concluído em {stats.elapsed:.1f}s: {stats.documents} documentos de {stats.songs} músicas, "
+          f"{stats.failed} com erro")
+
+def use_library(args):
+    library = open_library(args.biblioteca) or open_library(DEFAULT_LIBRARY)
+    if args.indexar:
+        stats = library.index_directory(args.indexar)
+        print(f"Indexadas: {stats.added} novas, {stats.updated} atualizadas, "
+              f"{stats.unchanged} sem mudança, {stats.removed} removidas, {stats.errors} com erro")
+    if args.buscar is not None or args.progressao or args.tom:
+        results = library.search(args.buscar or '', progression=args.progressao, key=args.tom)
+        if not results:
+            print("Nenhuma música encontrada.")
+        for result in results:
+            print(f"{result.title} - {result.artist} ({result.key or 'sem tom'}): {result.source}")
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+
     try:
-        if os.path.isfile(url):
-            title, artist, key, lines = get_content_from_file(url)
+        if args.indexar or args.buscar is not None or args.progressao or args.tom:
+            use_library(args)
+            sys.exit(0)
+
+        if args.repertorio:
+            build_songbook(args.repertorio, args.formato or 'pdf', args.titulo)
+            sys.exit(0)
+
+        if args.aquecer or args.aquecer_log:
+            warm_caches(args)
+            sys.exit(0)
+
+        if args.varias:
+            convert_many(args)
+            sys.exit(0)
+
+        if args.entrada and os.path.isdir(args.entrada):
+            convert_folder(args)
+            sys.exit(0)
+
+        base_filename, layout = convert_single(args.entrada)
+
+        if args.zip:
+            zip_filename = f"{base_filename}.zip"
+            with open(zip_filename, "wb") as f:
+                render_zip(layout, base_filename, stream=f)
+            print(f"ZIP gerado com sucesso: {zip_filename}")
         else:
-            title, artist, key, lines = get_cifra_content(url)
-        
-        # Sanitize filename
-        safe_title = "".join([c for c in title if c.isalpha() or c.isdigit() or c==' ']).rstrip()
-        safe_artist = "".join([c for c in artist if c.isalpha() or c.isdigit() or c==' ']).rstrip()
-        base_filename = f"{safe_title}_{safe_artist}".replace(" ", "_")
-        
-        pdf_filename = f"{base_filename}.pdf"
-        docx_filename = f"{base_filename}.docx"
-        
-        pdf_bytes = generate_pdf_bytes(title, artist, key, lines)
-        with open(pdf_filename, "wb") as f:
-            f.write(pdf_bytes)
-        print(f"PDF gerado com sucesso: {pdf_filename}")
-        
-        docx_bytes = generate_docx_bytes(title, artist, key, lines)
-        with open(docx_filename, "wb") as f:
-            f.write(docx_bytes)
-        print(f"DOCX gerado com sucesso: {docx_filename}")
-        
+            pdf_filename = f"{base_filename}.pdf"
+            with open(pdf_filename, "wb") as f:
+                render(layout, 'pdf', f)
+            print(f"PDF gerado com sucesso: {pdf_filename}")
+
+            docx_filename = f"{base_filename}.docx"
+            with open(docx_filename, "wb") as f:
+                render(layout, 'docx', f)
+            print(f"DOCX gerado com sucesso: {docx_filename}")
+
     except Exception as e:
         print(f"Erro: {e}")
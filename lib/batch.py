@@ -0,0 +1,172 @@
+"""Folder conversion: every .txt chart under a directory to PDF/DOCX.
+
+Files are converted across a pool of warm worker processes (the same
+spawn pool as the API's render executor), each parsed and laid out once
+for all requested formats. A manifest in the output folder remembers, per
+chart, the content hash and the render settings its documents were made
+with; on the next run unchanged charts whose documents still exist are
+skipped without being read again when their size and mtime match.
+"""
+import os
+import json
+import time
+import hashlib
+from collections import namedtuple
+from concurrent.futures import as_completed
+
+from lib.cifra_logic import get_content_from_file, layout_song, render, LAYOUT_PARAMS
+from lib.jobs import build_process_pool
+
+MANIFEST_NAME = '.cifra_manifest.json'
+MANIFEST_VERSION = 1
+
+BatchStats = namedtuple('BatchStats', ['converted', 'skipped', 'failed', 'elapsed'])
+
+# Sources whose changes alter the documents: a template tweak in any of
+# them re-renders everything on the next run.
+_RENDER_SOURCES = ('cifra_logic.py', 'docx_writer.py')
+
+def render_settings(formats):
+    """Fingerprint of everything besides the chart that shapes the output."""
+    digest = hashlib.sha256(repr((LAYOUT_PARAMS, sorted(formats))).encode('utf-8'))
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in _RENDER_SOURCES:
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def find_charts(root):
+    """Relative paths of the .txt files under `root`, in a stable order."""
+    charts = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.lower().endswith('.txt'):
+                charts.append(os.path.relpath(os.path.join(dirpath, filename), root))
+    return charts
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+def save_manifest(path, files):
+    # Written aside and renamed, so an interrupted run never leaves it torn
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def output_paths(relative_path, output_dir, formats):
+    base = os.path.splitext(os.path.join(output_dir, relative_path))[0]
+    return [f"{base}.{format_type}" for format_type in formats]
+
+def convert_file(source, outputs, formats):
+    """Parse and lay out one chart once, then write each format. Runs in the pool."""
+    layout = layout_song(*get_content_from_file(source))
+    os.makedirs(os.path.dirname(outputs[0]) or '.', exist_ok=True)
+    for output, format_type in zip(outputs, formats):
+        with open(output, 'wb') as f:
+            render(layout, format_type, f)
+    return outputs
+
+def _is_current(entry, record, outputs):
+    return (entry is not None
+            and all(entry.get(field) == record[field] for field in ('digest', 'settings', 'outputs'))
+            and all(os.path.exists(output) for output in outputs))
+
+def convert_directory(root, output_dir=None, formats=('pdf', 'docx'), workers=None, force=False, progress=print):
+    """Convert every chart under `root`; returns BatchStats.
+
+    Documents mirror the folder layout under `output_dir` (default: next
+    to the charts). `force` ignores the manifest and converts everything.
+    """
+    start = time.perf_counter()
+    root = os.path.abspath(root)
+    output_dir = os.path.abspath(output_dir or root)
+    formats = list(formats)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    previous = {} if force else load_manifest(manifest_path)
+    settings = render_settings(formats)
+
+    files = {}
+    pending = []
+    skipped = failed = 0
+    for relative_path in find_charts(root):
+        source = os.path.join(root, relative_path)
+        outputs = output_paths(relative_path, output_dir, formats)
+        relative_outputs = [os.path.relpath(output, output_dir) for output in outputs]
+        entry = previous.get(relative_path)
+        try:
+            stat = os.stat(source)
+            # Same size and mtime as last time: trust the recorded hash
+            if entry is not None and (entry.get('mtime'), entry.get('size')) == (stat.st_mtime, stat.st_size):
+                digest = entry.get('digest')
+            else:
+                digest = file_digest(source)
+        except OSError as e:
+            progress(f"Erro em {relative_path}: {e}")
+            failed += 1
+            continue
+        record = {'digest': digest, 'settings': settings, 'outputs': relative_outputs,
+                  'mtime': stat.st_mtime, 'size': stat.st_size}
+        if _is_current(entry, record, outputs):
+            files[relative_path] = record
+            skipped += 1
+        else:
+            pending.append((relative_path, source, outputs, record))
+
+    total = len(pending)
+    converted = 0
+    if pending:
+        progress(f"Convertendo {total} cifras ({skipped} sem mudança)...")
+    try:
+        for done, (relative_path, record, error) in enumerate(_run(pending, formats, workers), 1):
+            if error is None:
+                files[relative_path] = record
+                converted += 1
+                progress(f"[{done}/{total}] {relative_path}")
+            else:
+                failed += 1
+                progress(f"[{done}/{total}] Erro em {relative_path}: {error}")
+    finally:
+        # Whatever finished is kept even if the run is interrupted
+        os.makedirs(output_dir, exist_ok=True)
+        save_manifest(manifest_path, files)
+    return BatchStats(converted, skipped, failed, time.perf_counter() - start)
+
+def _run(pending, formats, workers):
+    """Yield (relative path, manifest record, error or None) as charts finish."""
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    if workers <= 1:
+        for relative_path, source, outputs, record in pending:
+            try:
+                convert_file(source, outputs, formats)
+                yield relative_path, record, None
+            except Exception as e:
+                yield relative_path, record, e
+        return
+
+    pool = build_process_pool(workers)
+    try:
+        futures = {
+            pool.submit(convert_file, source, outputs, formats): (relative_path, record)
+            for relative_path, source, outputs, record in pending
+        }
+        for future in as_completed(futures):
+            relative_path, record = futures[future]
+            error = future.exception()
+            yield relative_path, record, error
+    except BaseException:
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown()
@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import urlsplit, urlunsplit
+
+from lib.settings import env_number
+
+# Defaults for the parsed-song cache; all of them can be overridden through
+# environment variables so the Vercel function and the CLI can be tuned
+# without code changes.
+DEFAULT_TTL = 6 * 60 * 60          # seconds
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_DISK_ENTRIES = 5000
+DEFAULT_RENDER_ENTRIES = 512
+DEFAULT_RENDER_BYTES = 64 * 1024 * 1024
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with optional TTL.
+
+    Expired entries are not dropped on read: they stay available to
+    get_stale (for conditional revalidation) until LRU eviction.
+
+    With `max_bytes`, entries are also evicted while the summed
+    `size_of(value)` exceeds it; a value larger than the budget is not kept.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MEMORY_ENTRIES, ttl=None, max_bytes=None, size_of=len):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl is None or time.time() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def get_stale(self, key, default=None):
+        """Value for `key` even if its TTL expired (not counted as a hit)."""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[1] if entry is not None else default
+
+    def _weight(self, value):
+        return self.size_of(value) if self.max_bytes is not None else 0
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= self._weight(entry[1])
+
+    def set(self, key, value, stored_at=None):
+        """Store `value`; `stored_at` keeps the age of a copy from another tier."""
+        with self._lock:
+            self._pop(key)
+            weight = self._weight(value)
+            if self.max_bytes is not None and weight > self.max_bytes:
+                return
+            self._data[key] = (time.time() if stored_at is None else stored_at, value)
+            self._bytes += weight
+            while len(self._data) > self.max_entries or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        stats = {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'max_entries': self.max_entries}
+        if self.max_bytes is not None:
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+        return stats
+
+class DiskCache:
+    """SQLite-backed cache tier with TTL and an entry cap.
+
+    Values are stored as the text or bytes produced by `encode` and read
+    back with `decode` (JSON by default). The connection is opened lazily and reopened
+    after a fork so the same instance can be shared by worker processes.
+    Like LRUCache, expired rows are kept for get_stale until evicted.
+
+    `version` identifies the encoding: a file written with another version
+    is emptied when opened, and a row that fails to decode is deleted and
+    read as a miss.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_DISK_ENTRIES, ttl=DEFAULT_TTL,
+                 encode=json.dumps, decode=json.loads, version=0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.encode = encode
+        self.decode = decode
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at)")
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.version:
+                self._conn.execute("DELETE FROM entries")
+                self._conn.execute(f"PRAGMA user_version = {int(self.version)}")
+                self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key, default=None):
+        entry = self.get_entry(key)
+        return entry[1] if entry is not None else default
+
+    def get_entry(self, key):
+        """(stored_at, value) for a fresh `key`, or None."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value, stored_at = row
+                if self.ttl is None or now - stored_at < self.ttl:
+                    value = self._decode(conn, key, value)
+                    if value is not None:
+                        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                        conn.commit()
+                        self.hits += 1
+                        return stored_at, value
+            self.misses += 1
+            return None
+
+    def get_stale(self, key, default=None):
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            value = self._decode(conn, key, row[0]) if row is not None else None
+        return value if value is not None else default
+
+    def _decode(self, conn, key, value):
+        # A row this code cannot read is dropped rather than failing every lookup
+        try:
+            return self.decode(value)
+        except (ValueError, TypeError) as e:
+            print(f"WARN: dropping unreadable cache entry {key}: {e}", file=sys.stderr)
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.commit()
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        encoded = self.encode(value)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, encoded, now, now),
+            )
+            # Evict least recently used rows beyond the cap
+            conn.execute(
+                "DELETE FROM entries WHERE key IN ("
+                "SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM entries")
+            conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self), 'max_entries': self.max_entries}
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    The first caller runs the function; callers arriving while it is in
+    flight wait and get the same result (or exception). Nothing is kept
+    once the call finishes, so this complements a cache rather than being one.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.executed += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        return {'executed': self.executed, 'shared': self.shared, 'in_flight': len(self._calls)}
+
+class TieredCache:
+    """Memory LRU in front of an optional disk tier.
+
+    Disk hits are promoted into memory with their original age; writes go
+    to both tiers.
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        if self.disk is not None:
+            entry = self.disk.get_entry(key)
+            if entry is not None:
+                # Promoted with its disk age so it still expires on time
+                stored_at, value = entry
+                self.memory.set(key, value, stored_at)
+                return value
+        return default
+
+    def get_stale(self, key, default=None):
+        value = self.memory.get_stale(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get_stale(key)
+        return value if value is not None else default
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        stats = {'memory': self.memory.stats()}
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+def normalize_song_url(url):
+    """Canonical cache key for a Cifra Club song URL.
+
+    Drops the fragment (key selection, #google_vignette, ...), lowercases
+    scheme and host, forces https and a trailing slash on the path.
+    """
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or 'https').lower()
+    if scheme == 'http':
+        scheme = 'https'
+    path = parts.path or '/'
+    if not path.endswith('/'):
+        path += '/'
+    return urlunsplit((scheme, parts.netloc.lower(), path, parts.query, ''))
+
+def build_song_cache(encode=json.dumps, decode=json.loads, version=0):
+    """Create the parsed-song cache from environment settings.
+
+    CIFRA_CACHE_TTL          TTL in seconds for both tiers (default 6h)
+    CIFRA_CACHE_SIZE         max entries kept in memory (default 256)
+    CIFRA_CACHE_DIR          enables the SQLite disk tier in this directory
+    CIFRA_CACHE_DISK_SIZE    max entries kept on disk (default 5000)
+
+    `encode`/`decode` convert values to and from the text stored on disk;
+    `version` identifies that encoding (see DiskCache).
+    """
+    ttl = env_number('CIFRA_CACHE_TTL', DEFAULT_TTL, float)
+    memory = LRUCache(env_number('CIFRA_CACHE_SIZE', DEFAULT_MEMORY_ENTRIES), ttl)
+    disk = None
+    cache_dir = os.environ.get('CIFRA_CACHE_DIR')
+    if cache_dir:
+        disk = DiskCache(
+            os.path.join(cache_dir, 'songs.sqlite3'),
+            env_number('CIFRA_CACHE_DISK_SIZE', DEFAULT_DISK_ENTRIES),
+            ttl,
+            encode,
+            decode,
+            version,
+        )
+    return TieredCache(memory, disk)
+
+def build_render_cache(size_of=len):
+    """Create the rendered-document cache (memory only) from environment settings.
+
+    CIFRA_RENDER_CACHE_SIZE     max documents kept (default 512)
+    CIFRA_RENDER_CACHE_BYTES    max total size of the documents (default 64 MiB)
+
+    Entries never expire: their keys already include everything the output
+    depends on.
+    """
+    return LRUCache(
+        env_number('CIFRA_RENDER_CACHE_SIZE', DEFAULT_RENDER_ENTRIES),
+        None,
+        env_number('CIFRA_RENDER_CACHE_BYTES', DEFAULT_RENDER_BYTES),
+        size_of,
+    )
@@ -1,83 +1,156 @@
-import requests
-from bs4 import BeautifulSoup
-from fpdf import FPDF
+import os
+import re
 import sys
 import io
-from docx import Document
-from docx.shared import Pt, Cm
-from docx.enum.section import WD_ORIENT
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-
-class PDF(FPDF):
-    def header(self):
-        self.set_font('Helvetica', 'B', 15)
-        # Title will be set in the main logic
-        
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Helvetica', 'I', 8)
-        self.cell(0, 10, f'Página {self.page_no()}/{{nb}}', align='C')
+import threading
+import json
+import html
+import hashlib
+import datetime
+import zipfile
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures.process import BrokenProcessPool
+from lib.cache import build_song_cache, build_render_cache, normalize_song_url, SingleFlight
+from lib.jobs import build_process_pool, warm_pool, is_main_process
+from lib.fetcher import fetch
+from lib.extract import extract_cifra
+from lib.metrics import span
+from lib.settings import env_number
+from lib.docx_writer import DocxWriter
+from lib.songpack import encode_song, SongView
+
+# bs4 and fpdf are imported by the functions that use them: a cold start
+# serving a cached or DOCX-only request never loads them (see
+# benchmarks/import_budget.py).
+
+@lru_cache(maxsize=None)
+def pdf_class():
+    from fpdf import FPDF
+
+    class PDF(FPDF):
+        def header(self):
+            self.set_font('Helvetica', 'B', 15)
+            # Title will be set in the main logic
+            
+        def footer(self):
+            self.set_y(-15)
+            self.set_font('Helvetica', 'I', 8)
+            self.cell(0, 10, f'Página {self.page_no()}/{{nb}}', align='C')
+
+    return PDF
+
+def preload_dependencies():
+    """Import every lazily loaded dependency now (warm worker processes)."""
+    import bs4  # noqa: F401
+    pdf_class()
 
 NOTES_SHARP = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 NOTES_FLAT = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B']
 
+CHORD_CHARS = frozenset("ABCDEFGMmb#0123456789/()+-^°ºdimsusaug ")
+
+def is_chord_text(text):
+    return bool(text) and all(c in CHORD_CHARS for c in text)
+
+# A run of text with a single style. Chords are bold; italic marks repeated
+# section headers whose body was dropped by deduplicate_sections.
+Segment = namedtuple('Segment', ['text', 'bold', 'italic'], defaults=(False, False))
+
+class Line:
+    """One line of the chart: its segments plus text and classification
+    computed once at construction, so the layout code never re-joins them.
+    """
+    __slots__ = ('segments', 'text', 'stripped', 'length', 'is_chord', 'is_header')
+
+    def __init__(self, segments=()):
+        self.segments = tuple(segments)
+        self.text = "".join([s.text for s in self.segments])
+        self.stripped = self.text.strip()
+        self.length = len(self.text)
+        self.is_chord = any(s.bold for s in self.segments) or is_chord_text(self.stripped)
+        self.is_header = self.stripped.startswith('[') and self.stripped.endswith(']')
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __bool__(self):
+        return bool(self.segments)
+
+    def __eq__(self, other):
+        return isinstance(other, Line) and self.segments == other.segments
+
+    def __hash__(self):
+        return hash(self.segments)
+
+    def __repr__(self):
+        return f"Line({list(self.segments)!r})"
+
+EMPTY_LINE = Line()
+
+# Every spelling we accept for a note, including the enharmonic oddities
+# (Cb, B#, Fb, E#) that show up in hand-written charts.
+NOTE_INDEX = dict(
+    [(name, i) for i, name in enumerate(NOTES_FLAT)] +
+    [(name, i) for i, name in enumerate(NOTES_SHARP)] +
+    [('Cb', 11), ('B#', 0), ('Fb', 4), ('E#', 5)]
+)
+
+# TRANSPOSE_TABLE[use_flats][semitones][note index] -> note name, so
+# transposing a known note is two list lookups.
+TRANSPOSE_TABLE = [
+    [[names[(idx + shift) % 12] for idx in range(12)] for shift in range(12)]
+    for names in (NOTES_SHARP, NOTES_FLAT)
+]
+
+# Tokenized chord: note indices are -1 when the text is not a known note,
+# in which case the original text is kept as-is. bass_text is None when the
+# chord has no slash.
+ChordToken = namedtuple('ChordToken', ['root', 'root_text', 'suffix', 'bass', 'bass_text', 'bass_suffix'])
+
 def get_note_index(note):
-    # Normalize note
-    note = note.replace('Cb', 'B').replace('B#', 'C').replace('Fb', 'E').replace('E#', 'F')
-    if note in NOTES_SHARP:
-        return NOTES_SHARP.index(note)
-    if note in NOTES_FLAT:
-        return NOTES_FLAT.index(note)
-    return -1
+    return NOTE_INDEX.get(note, -1)
 
 def transpose_note(note, semitones, use_flats=False):
     idx = get_note_index(note)
     if idx == -1: return note
-    new_idx = (idx + semitones) % 12
-    return NOTES_FLAT[new_idx] if use_flats else NOTES_SHARP[new_idx]
+    return TRANSPOSE_TABLE[use_flats][semitones % 12][idx]
+
+def split_note(text):
+    """(note, rest) of a chord or key; a note is one letter plus an optional accidental."""
+    note_len = 2 if len(text) > 1 and text[1] in '#b' else 1
+    return text[:note_len], text[note_len:]
+
+@lru_cache(maxsize=4096)
+def tokenize_chord(chord):
+    root_part, slash, bass_part = chord.partition('/')
+    root_text, suffix = split_note(root_part)
+    bass, bass_text, bass_suffix = -1, None, ''
+    if slash:
+        bass_text, bass_suffix = split_note(bass_part)
+        bass = get_note_index(bass_text)
+    return ChordToken(get_note_index(root_text), root_text, suffix, bass, bass_text, bass_suffix)
 
+@lru_cache(maxsize=8192)
 def transpose_chord(chord, semitones, use_flats=False):
-    # Split root and bass
-    parts = chord.split('/')
-    root_part = parts[0]
-    bass_part = parts[1] if len(parts) > 1 else None
+    token = tokenize_chord(chord)
+    names = TRANSPOSE_TABLE[use_flats][semitones % 12]
     
-    # Extract root note
-    root_len = 0
-    if len(root_part) > 1 and root_part[1] in ['#', 'b']:
-        root_len = 2
-    else:
-        root_len = 1
-    
-    root_note = root_part[:root_len]
-    suffix = root_part[root_len:]
-    
-    new_root = transpose_note(root_note, semitones, use_flats)
-    new_chord = new_root + suffix
-    
-    if bass_part:
-        bass_len = 0
-        if len(bass_part) > 1 and bass_part[1] in ['#', 'b']:
-            bass_len = 2
-        else:
-            bass_len = 1
-        bass_note = bass_part[:bass_len]
-        bass_suffix = bass_part[bass_len:]
-        
-        new_bass = transpose_note(bass_note, semitones, use_flats)
-        new_chord += '/' + new_bass + bass_suffix
+    new_chord = (names[token.root] if token.root != -1 else token.root_text) + token.suffix
+    if token.bass_text is not None:
+        new_bass = names[token.bass] if token.bass != -1 else token.bass_text
+        new_chord += '/' + new_bass + token.bass_suffix
         
     return new_chord
 
 def transpose_lines(lines, semitones, use_flats=False):
     new_lines = []
     for line in lines:
-        if is_chord_line(line):
-            new_line = []
-            for segment in line:
-                if segment.get('bold'): # It's a chord
-                    text = segment['text']
-                    parts = text.split(' ')
+        if line.is_chord:
+            new_segments = []
+            for segment in line.segments:
+                if segment.bold: # It's a chord
+                    parts = segment.text.split(' ')
                     new_parts = []
                     for part in parts:
                         if not part:
@@ -88,29 +161,135 @@ def transpose_lines(lines, semitones, use_flats=False):
                             new_parts.append(transpose_chord(part, semitones, use_flats))
                         else:
                             new_parts.append(part)
-                    new_text = ' '.join(new_parts)
-                    
-                    new_segment = segment.copy()
-                    new_segment['text'] = new_text
-                    new_line.append(new_segment)
+                    new_segments.append(segment._replace(text=' '.join(new_parts)))
                 else:
-                    new_line.append(segment)
-            new_lines.append(new_line)
+                    new_segments.append(segment)
+            new_lines.append(Line(new_segments))
         else:
             new_lines.append(line)
     return new_lines
 
-def get_cifra_content(url, target_key_index=None):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Erro ao acessar a URL: {e}")
+# Immutable parsed song. Unpacks like the (title, artist, key, lines) tuple
+# the rest of the code has always passed around; `lines` is a tuple so a
+# cached song can be shared safely between requests.
+Song = namedtuple('Song', ['title', 'artist', 'key', 'lines'])
+
+def make_song(title, artist, key, lines):
+    return Song(title, artist, key, tuple(lines))
+
+def song_to_bytes(song, extra=()):
+    """Compact binary form (lib.songpack) for caches and other processes."""
+    return encode_song(song, extra)
+
+def song_from_bytes(data):
+    """Song from song_to_bytes output (bytes or memoryview)."""
+    return _song_from_view(SongView(data))
+
+def _song_from_view(view):
+    # Repeated lines (choruses, blank lines) and segments are built once and
+    # shared, which is safe since neither is ever mutated
+    segments = {}
+    lines = {}
+    song_lines = []
+    for packed in view.packed_lines():
+        line = lines.get(packed)
+        if line is None:
+            for value in packed:
+                if value not in segments:
+                    segments[value] = Segment(*view.segment(value))
+            line = lines[packed] = Line([segments[value] for value in packed])
+        song_lines.append(line)
+    return make_song(view.title, view.artist, view.key, song_lines)
+
+# Explicit mapping based on Cifra Club values
+# C: key=3, D: key=5, E: key=7, F: key=8, G: key=10, A: key=0, B: key=2
+# We map these to our chromatic index (0=C, 1=C#, etc.)
+CIFRA_CLUB_KEY_MAP = {
+    0: 9,   # A
+    1: 10,  # A# / Bb
+    2: 11,  # B
+    3: 0,   # C
+    4: 1,   # C# / Db
+    5: 2,   # D
+    6: 3,   # D# / Eb
+    7: 4,   # E
+    8: 5,   # F
+    9: 6,   # F# / Gb
+    10: 7,  # G
+    11: 8   # G# / Ab
+}
+
+# Song cache entry: the parsed song plus the HTTP validators of the page it
+# came from, used to revalidate expired entries with a conditional GET.
+CachedSong = namedtuple('CachedSong', ['song', 'etag', 'last_modified'])
+
+# Version of the CachedSong encoding on disk; bump it when the encoding
+# changes and existing disk caches start empty instead of failing to decode.
+SONG_CACHE_VERSION = 1
+
+def _encode_cached_song(entry):
+    return song_to_bytes(entry.song, (entry.etag, entry.last_modified))
+
+def _decode_cached_song(value):
+    view = SongView(value)
+    etag, last_modified = view.extra
+    return CachedSong(_song_from_view(view), etag, last_modified)
+
+_song_cache = build_song_cache(encode=_encode_cached_song, decode=_decode_cached_song, version=SONG_CACHE_VERSION)
+
+# Concurrent requests for the same page (or the same document) share one
+# fetch (or one fetch + render) instead of each doing the work.
+_song_loads = SingleFlight()
+_generations = SingleFlight()
+
+def song_cache_stats():
+    return _song_cache.stats()
+
+def coalescing_stats():
+    return {'loads': _song_loads.stats(), 'generations': _generations.stats()}
+
+def _lines_from_pre_events(events):
+    """Build Lines from the ('text' | 'b' | 'br', text) children of <pre>."""
+    lines = []
+    current_line = []
+    
+    for kind, text in events:
+        if kind == 'b':
+            current_line.append(Segment(text, True))
+        elif kind == 'br':
+            lines.append(Line(current_line))
+            current_line = []
+        else:
+            parts = text.split('\n')
+            for i, part in enumerate(parts):
+                if part:
+                    current_line.append(Segment(part))
+                if i < len(parts) - 1:
+                    lines.append(Line(current_line))
+                    current_line = []
+    
+    if current_line:
+        lines.append(Line(current_line))
+    return lines
+
+def parse_cifra_html(content):
+    """Parse a Cifra Club page into an untransposed Song.
 
-    soup = BeautifulSoup(response.content, 'html.parser')
+    Uses the targeted extractor in lib.extract and falls back to a full
+    BeautifulSoup parse when it cannot make sense of the page.
+    """
+    extracted = extract_cifra(content)
+    if extracted is None:
+        return parse_cifra_html_soup(content)
+    
+    title = extracted.title if extracted.title is not None else "Título Desconhecido"
+    artist = extracted.artist if extracted.artist is not None else "Artista Desconhecido"
+    key = f"Tom: {extracted.key}" if extracted.key else ""
+    return make_song(title, artist, key, _lines_from_pre_events(extracted.pre))
+
+def parse_cifra_html_soup(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
 
     # Extract Title and Artist
     title_tag = soup.find('h1', class_='t1')
@@ -132,111 +311,146 @@ def get_cifra_content(url, target_key_index=None):
         raise Exception("Não foi possível encontrar a cifra (tag <pre> não encontrada).")
 
     # Parse content preserving bold tags
-    lines = []
-    current_line = []
-    
+    events = []
     for element in pre_content.contents:
         if element.name == 'b':
-            text = element.get_text()
-            current_line.append({'text': text, 'bold': True})
+            events.append(('b', element.get_text()))
         elif element.name == 'br':
-            lines.append(current_line)
-            current_line = []
+            events.append(('br', None))
         elif isinstance(element, str) or (element.string and element.name is None):
-            text = str(element)
-            parts = text.split('\n')
-            for i, part in enumerate(parts):
-                if part:
-                    current_line.append({'text': part, 'bold': False})
-                if i < len(parts) - 1:
-                    lines.append(current_line)
-                    current_line = []
+            events.append(('text', str(element)))
+
+    return make_song(title, artist, key, _lines_from_pre_events(events))
+
+def load_cifra(url):
+    """Fetch and parse a Cifra Club page, going through the song cache.
+
+    Returns the untransposed Song so one cached entry serves every target
+    key and output format; use transpose_song for key changes.
+    """
+    cache_key = normalize_song_url(url)
+    entry = _song_cache.get(cache_key)
+    if entry is not None:
+        return entry.song
+    return _song_loads.do(cache_key, _load_cifra, url, cache_key)
+
+def refresh_cifra(url):
+    """Like load_cifra, but revalidates even a fresh entry, renewing its TTL."""
+    cache_key = normalize_song_url(url)
+    return _song_loads.do(cache_key, _load_cifra, url, cache_key)
+
+def _load_cifra(url, cache_key):
+    # Expired entries are revalidated instead of refetched when the page
+    # sent validators; a 304 just renews the cached parse.
+    stale = _song_cache.get_stale(cache_key)
+    with span('fetch'):
+        if stale is not None and (stale.etag or stale.last_modified):
+            result = fetch(url, stale.etag, stale.last_modified)
+        else:
+            result = fetch(url)
     
-    if current_line:
-        lines.append(current_line)
+    if result.not_modified:
+        entry = stale
+    else:
+        with span('parse'):
+            song = parse_cifra_html(result.content)
+        entry = CachedSong(song, result.etag, result.last_modified)
+    _song_cache.set(cache_key, entry)
+    return entry.song
+
+def parse_key(key):
+    """Split a key label such as "Tom: C#m" into (note index, is_minor).
+
+    The note index is -1 when the label cannot be parsed.
+    """
+    # Clean key text more robustly
+    clean_key = key.lower().replace("tom:", "").strip()
+    # Restore case for note parsing (first letter upper)
+    if clean_key:
+        clean_key = clean_key[0].upper() + clean_key[1:]
     
-    # Transposition Logic
-    if target_key_index is not None and key:
-        try:
-            # Clean key text more robustly
-            clean_key = key.lower().replace("tom:", "").strip()
-            # Restore case for note parsing (first letter upper)
-            if clean_key:
-                clean_key = clean_key[0].upper() + clean_key[1:]
-            
-            original_key_note = clean_key
-            
-            print(f"DEBUG: Scraped key: '{key}', Cleaned: '{original_key_note}'", file=sys.stderr)
-            
-            # Handle minor keys? "Cm" -> "C"
-            is_minor = 'm' in original_key_note
-            if is_minor:
-                original_key_note = original_key_note.replace('m', '')
-            
-            original_idx = get_note_index(original_key_note)
-            print(f"DEBUG: Original Key Index: {original_idx}, Target (Cifra): {target_key_index}", file=sys.stderr)
+    original_key_note = clean_key
+    
+    print(f"DEBUG: Scraped key: '{key}', Cleaned: '{original_key_note}'", file=sys.stderr)
+    
+    # Handle minor keys? "Cm" -> "C"
+    is_minor = 'm' in original_key_note
+    if is_minor:
+        original_key_note = original_key_note.replace('m', '')
+    
+    return get_note_index(original_key_note), is_minor
+
+def transpose_song(song, target_key_index):
+    """Return `song` transposed to a Cifra Club key index (see CIFRA_CLUB_KEY_MAP).
+
+    Works on the already-parsed lines only, so changing key never touches
+    the network or the HTML parser. The song is returned unchanged when it
+    has no key or the key cannot be parsed.
+    """
+    if target_key_index is None or not song.key:
+        return song
+    with span('transpose'):
+        return _transpose_song(song, target_key_index)
+
+def _transpose_song(song, target_key_index):
+    try:
+        original_idx, is_minor = parse_key(song.key)
+        print(f"DEBUG: Original Key Index: {original_idx}, Target (Cifra): {target_key_index}", file=sys.stderr)
+        
+        if original_idx == -1:
+            return song
             
-            if original_idx != -1:
-                # Explicit mapping based on Cifra Club values
-                # C: key=3, D: key=5, E: key=7, F: key=8, G: key=10, A: key=0, B: key=2
-                # We map these to our chromatic index (0=C, 1=C#, etc.)
-                CIFRA_CLUB_KEY_MAP = {
-                    0: 9,   # A
-                    1: 10,  # A# / Bb
-                    2: 11,  # B
-                    3: 0,   # C
-                    4: 1,   # C# / Db
-                    5: 2,   # D
-                    6: 3,   # D# / Eb
-                    7: 4,   # E
-                    8: 5,   # F
-                    9: 6,   # F# / Gb
-                    10: 7,  # G
-                    11: 8   # G# / Ab
-                }
-                
-                if target_key_index in CIFRA_CLUB_KEY_MAP:
-                    target_chromatic_index = CIFRA_CLUB_KEY_MAP[target_key_index]
-                else:
-                    # Fallback to formula if key is outside 0-11 range (though unlikely)
-                    print(f"WARN: Unknown key index {target_key_index}, using formula.", file=sys.stderr)
-                    target_chromatic_index = (target_key_index + 9) % 12
-                
-                semitones = target_chromatic_index - original_idx
-                print(f"DEBUG: Target Chromatic: {target_chromatic_index}, Semitones: {semitones}", file=sys.stderr)
-                
-                # Determine target key name for display and accidental preference
-                # Heuristic for flats: F(5), Bb(10), Eb(3), Ab(8), Db(1)
-                use_flats = target_chromatic_index in [1, 3, 5, 8, 10]
-                
-                lines = transpose_lines(lines, semitones, use_flats)
-                
-                # Update key text
-                new_key_note = NOTES_FLAT[target_chromatic_index] if use_flats else NOTES_SHARP[target_chromatic_index]
-                key = f"Tom: {new_key_note}{'m' if is_minor else ''}"
-        except Exception as e:
-            print(f"Error transposing: {e}", file=sys.stderr)
-
-    return title, artist, key, lines
-
-def is_chord_line(line_segments):
-    has_bold = any(s['bold'] for s in line_segments)
-    if has_bold:
-        return True
+        if target_key_index in CIFRA_CLUB_KEY_MAP:
+            target_chromatic_index = CIFRA_CLUB_KEY_MAP[target_key_index]
+        else:
+            # Fallback to formula if key is outside 0-11 range (though unlikely)
+            print(f"WARN: Unknown key index {target_key_index}, using formula.", file=sys.stderr)
+            target_chromatic_index = (target_key_index + 9) % 12
+        
+        semitones = target_chromatic_index - original_idx
+        print(f"DEBUG: Target Chromatic: {target_chromatic_index}, Semitones: {semitones}", file=sys.stderr)
         
-    text = "".join([s['text'] for s in line_segments]).strip()
-    if not text:
-        return False
+        # Determine target key name for display and accidental preference
+        # Heuristic for flats: F(5), Bb(10), Eb(3), Ab(8), Db(1)
+        use_flats = target_chromatic_index in [1, 3, 5, 8, 10]
         
-    allowed = set("ABCDEFGMmb#0123456789/()+-^°ºdimsusaug ")
-    if all(c in allowed for c in text):
-        return True
+        lines = transpose_lines(song.lines, semitones, use_flats)
         
-    return False
+        # Update key text
+        new_key_note = NOTES_FLAT[target_chromatic_index] if use_flats else NOTES_SHARP[target_chromatic_index]
+        key = f"Tom: {new_key_note}{'m' if is_minor else ''}"
+        return make_song(song.title, song.artist, key, lines)
+    except Exception as e:
+        print(f"Error transposing: {e}", file=sys.stderr)
+        return song
+
+def split_song_url(url):
+    """Split a song URL into (url, target key index).
 
-def is_header_line(line_segments):
-    text = "".join([s['text'] for s in line_segments]).strip()
-    return text.startswith('[') and text.endswith(']')
+    The key comes from a `key=N` parameter in the fragment, the way Cifra
+    Club links encode it (e.g. ".../#key=5"); the fragment is always
+    dropped (e.g. #google_vignette=true).
+    """
+    target_key_index = None
+    if '#' in url:
+        url, fragment = url.split('#', 1)
+        # Parse key=value from fragment
+        for param in fragment.split('&'):
+            if param.startswith('key='):
+                try:
+                    target_key_index = int(param.split('=')[1])
+                except ValueError:
+                    pass
+    return url, target_key_index
+
+def get_cifra_content(url, target_key_index=None):
+    return transpose_song(load_cifra(url), target_key_index)
+
+def is_chord_line(line):
+    return line.is_chord
+
+def is_header_line(line):
+    return line.is_header
 
 def deduplicate_sections(lines):
     deduplicated_lines = []
@@ -244,16 +458,11 @@ def deduplicate_sections(lines):
     skip_mode = False
     
     for line in lines:
-        if is_header_line(line):
-            text = "".join([s['text'] for s in line]).strip()
+        if line.is_header:
+            text = line.stripped
             if text in seen_headers:
                 skip_mode = True
-                new_line = []
-                for s in line:
-                    new_s = s.copy()
-                    new_s['italic'] = True
-                    new_line.append(new_s)
-                deduplicated_lines.append(new_line)
+                deduplicated_lines.append(Line([s._replace(italic=True) for s in line.segments]))
             else:
                 seen_headers.add(text)
                 skip_mode = False
@@ -269,76 +478,123 @@ def pair_lines(lines):
     i = 0
     while i < len(lines):
         line = lines[i]
-        text = "".join([s['text'] for s in line]).strip()
         
-        if not text:
+        if not line.stripped:
             i += 1
             continue
             
-        if is_header_line(line):
-            units.append({'type': 'header', 'chords': [], 'lyrics': line})
+        if line.is_header:
+            units.append({'type': 'header', 'chords': EMPTY_LINE, 'lyrics': line})
             i += 1
             continue
             
-        if is_chord_line(line):
+        if line.is_chord:
             if i + 1 < len(lines):
                 next_line = lines[i+1]
-                if is_header_line(next_line):
-                    units.append({'type': 'pair', 'chords': line, 'lyrics': []})
+                if next_line.is_header:
+                    units.append({'type': 'pair', 'chords': line, 'lyrics': EMPTY_LINE})
                     i += 1
-                elif not is_chord_line(next_line):
+                elif not next_line.is_chord:
                     units.append({'type': 'pair', 'chords': line, 'lyrics': next_line})
                     i += 2
                 else:
-                    units.append({'type': 'pair', 'chords': line, 'lyrics': []})
+                    units.append({'type': 'pair', 'chords': line, 'lyrics': EMPTY_LINE})
                     i += 1
             else:
-                units.append({'type': 'pair', 'chords': line, 'lyrics': []})
+                units.append({'type': 'pair', 'chords': line, 'lyrics': EMPTY_LINE})
                 i += 1
         else:
-            units.append({'type': 'pair', 'chords': [], 'lyrics': line})
+            units.append({'type': 'pair', 'chords': EMPTY_LINE, 'lyrics': line})
             i += 1
     return units
 
-def get_line_length(line_segments):
-    return len("".join([s['text'] for s in line_segments]))
-
-def pad_line(line_segments, target_length):
-    current_len = get_line_length(line_segments)
-    if current_len < target_length:
-        padding = " " * (target_length - current_len)
-        if line_segments:
-            new_segments = list(line_segments)
-            new_segments.append({'text': padding, 'bold': False})
-            return new_segments
+def get_line_length(line):
+    return line.length
+
+def padded_segments(line, target_length):
+    """Segments of `line` followed by a space run up to target_length."""
+    if line.length < target_length:
+        return line.segments + (Segment(" " * (target_length - line.length)),)
+    return line.segments
+
+def pad_line(line, target_length):
+    return Line(padded_segments(line, target_length))
+
+UNIT_GAP = 3
+SEPARATOR_LINE = Line([Segment(' ')])
+
+def measure_units(units):
+    """Precompute (is_header, width, has_chords, has_lyrics) for each unit.
+
+    The measures only depend on the units, so calculate_layout computes
+    them once and reuses them for every candidate font size.
+    """
+    measures = []
+    for unit in units:
+        chords, lyrics = unit['chords'], unit['lyrics']
+        measures.append((
+            unit['type'] == 'header',
+            max(chords.length, lyrics.length),
+            bool(chords.stripped),
+            bool(lyrics.stripped),
+        ))
+    return measures
+
+def count_rows(measures, max_chars):
+    """Number of rows reflow_units would produce, without building them."""
+    rows = 0
+    current_row_len = 0
+    in_row = False
+    row_chords = row_lyrics = False
+    
+    for is_header, width, has_chords, has_lyrics in measures:
+        if is_header:
+            if in_row:
+                rows += row_chords + row_lyrics
+                in_row = False
+            if rows:
+                rows += 1
+            rows += has_lyrics
+            continue
+        
+        if not in_row:
+            current_row_len = width
+            row_chords, row_lyrics = has_chords, has_lyrics
+            in_row = True
+        elif current_row_len + UNIT_GAP + width <= max_chars:
+            current_row_len += UNIT_GAP + width
+            row_chords = row_chords or has_chords
+            row_lyrics = row_lyrics or has_lyrics
         else:
-            return [{'text': " " * target_length, 'bold': False}]
-    return line_segments
+            rows += row_chords + row_lyrics
+            current_row_len = width
+            row_chords, row_lyrics = has_chords, has_lyrics
+    
+    if in_row:
+        rows += row_chords + row_lyrics
+    return rows
 
-def reflow_units(units, max_chars):
+def reflow_units(units, max_chars, measures=None):
+    if measures is None:
+        measures = measure_units(units)
     rows = []
     current_row_units = []
     current_row_len = 0
-    gap = 3
+    gap = UNIT_GAP
     
-    for i, unit in enumerate(units):
-        if unit.get('type') == 'header':
+    for unit, (is_header, unit_width, _, _) in zip(units, measures):
+        if is_header:
             if current_row_units:
                 rows.extend(build_row_lines(current_row_units, gap))
                 current_row_units = []
                 current_row_len = 0
             
             if rows: 
-                rows.append([{'text': ' ', 'bold': False}])
+                rows.append(SEPARATOR_LINE)
 
-            l_len = get_line_length(unit['lyrics'])
-            rows.extend(build_row_lines([(unit, l_len)], 0))
+            rows.extend(build_row_lines([(unit, unit_width)], 0))
             continue
 
-        c_len = get_line_length(unit['chords'])
-        l_len = get_line_length(unit['lyrics'])
-        unit_width = max(c_len, l_len)
-        
         needed = unit_width
         if current_row_units:
             needed += gap
@@ -361,172 +617,471 @@ def reflow_units(units, max_chars):
 def build_row_lines(row_units, gap):
     final_chords = []
     final_lyrics = []
+    gap_seg = Segment(" " * gap)
     
     for i, (unit, width) in enumerate(row_units):
         if i > 0:
-            gap_seg = [{'text': " " * gap, 'bold': False}]
-            final_chords.extend(gap_seg)
-            final_lyrics.extend(gap_seg)
+            final_chords.append(gap_seg)
+            final_lyrics.append(gap_seg)
             
-        padded_chords = pad_line(unit['chords'], width)
-        final_chords.extend(padded_chords)
-        
-        padded_lyrics = pad_line(unit['lyrics'], width)
-        final_lyrics.extend(padded_lyrics)
+        final_chords.extend(padded_segments(unit['chords'], width))
+        final_lyrics.extend(padded_segments(unit['lyrics'], width))
         
     result = []
-    if "".join([s['text'] for s in final_chords]).strip():
-        result.append(final_chords)
-    if "".join([s['text'] for s in final_lyrics]).strip():
-        result.append(final_lyrics)
+    for segments in (final_chords, final_lyrics):
+        row = Line(segments)
+        if row.stripped:
+            result.append(row)
         
     return result
 
+# Font sizes are searched on a half-point grid: DOCX stores sizes in
+# half-points, so a finer grid would render differently in each format.
+FONT_SIZE_MAX = 12
+FONT_SIZE_MIN = 8
+FONT_SIZE_STEP = 0.5
+FONT_SIZES = [FONT_SIZE_MAX - i * FONT_SIZE_STEP
+              for i in range(int((FONT_SIZE_MAX - FONT_SIZE_MIN) / FONT_SIZE_STEP) + 1)]
+
+def get_line_height(font_size):
+    return (font_size * 1.2) * 0.3527
+
+def get_max_chars(font_size, available_width):
+    char_width_mm = (font_size * 0.6) * 0.3527
+    return int(available_width / char_width_mm)
+
 def calculate_layout(lines, available_height, available_width):
+    """Pick the largest font size whose reflowed rows fit the page.
+
+    Binary search over FONT_SIZES using count_rows, which only needs the
+    per-unit measures; the rows themselves are built once for the chosen
+    size. Row counts are memoized per max_chars since neighbouring sizes
+    often wrap at the same width. Falls back to FONT_SIZE_MIN when nothing
+    fits.
+    """
     lines = deduplicate_sections(lines)
-    options = [12, 11.5, 11, 10.5, 10, 9.5, 9, 8.5, 8]
     units = pair_lines(lines)
+    measures = measure_units(units)
+    row_counts = {}
     
-    for font_size in options:
-        line_height = (font_size * 1.2) * 0.3527
-        char_width_mm = (font_size * 0.6) * 0.3527
-        max_chars = int(available_width / char_width_mm)
-        reflowed_lines = reflow_units(units, max_chars)
-        total_height_needed = len(reflowed_lines) * line_height
-        
-        if total_height_needed <= available_height:
-            return font_size, reflowed_lines, line_height
-            
-    fallback_size = 8
-    max_chars = int(available_width / ((fallback_size * 0.6) * 0.3527))
-    return fallback_size, reflow_units(units, max_chars), (fallback_size * 1.2) * 0.3527
+    def fits(font_size):
+        max_chars = get_max_chars(font_size, available_width)
+        if max_chars not in row_counts:
+            row_counts[max_chars] = count_rows(measures, max_chars)
+        return row_counts[max_chars] * get_line_height(font_size) <= available_height
+    
+    # FONT_SIZES is descending, so find the first index that fits
+    lo, hi = 0, len(FONT_SIZES) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if fits(FONT_SIZES[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    font_size = FONT_SIZES[lo]
+    
+    max_chars = get_max_chars(font_size, available_width)
+    return font_size, reflow_units(units, max_chars, measures), get_line_height(font_size)
 
-def generate_pdf_bytes(title, artist, key, lines):
-    pdf = PDF(orientation='P')
+# Page geometry shared by every renderer (A4 portrait, 5 mm margins, minus
+# the title/artist header). One layout is computed per song and handed to
+# whichever renderers the caller needs.
+USABLE_WIDTH = 200
+USABLE_HEIGHT = 270
+
+Layout = namedtuple('Layout', ['title', 'artist', 'key', 'font_size', 'rows', 'line_height'])
+
+def layout_song(title, artist, key, lines):
+    with span('layout'):
+        font_size, rows, line_height = calculate_layout(lines, USABLE_HEIGHT, USABLE_WIDTH)
+    return Layout(title, artist, key, font_size, tuple(rows), line_height)
+
+# Pinned timestamp for the PDF creation date and the zip members: the same
+# song, key and format must give the same bytes (and so the same ETag) on
+# every instance and after every cache eviction.
+DOCUMENT_DATE = datetime.datetime(1980, 1, 1, tzinfo=datetime.timezone.utc)
+
+def new_pdf():
+    pdf = pdf_class()(orientation='P')
+    pdf.set_creation_date(DOCUMENT_DATE)
     pdf.set_margins(5, 5, 5)
     pdf.alias_nb_pages()
-    pdf.add_page()
-    
+    return pdf
+
+COURIER_CHAR_WIDTH = 0.6  # em
+
+def pdf_row_pieces(row):
+    """(column, fpdf style, text) pieces to draw for one row.
+
+    Consecutive segments with the same bold/italic state are merged, and
+    whitespace-only segments (the padding added by pad_line and
+    build_row_lines) take the style of their neighbours, so a chord row is
+    usually a single piece. Leading and trailing blanks are not drawn.
+    """
+    pieces = []
+    column = 0
+    start = None
+    style = None
+    texts = []
+    blanks = 0
+    for segment in row:
+        text = segment.text
+        if not text.strip():
+            blanks += len(text)
+            continue
+        segment_style = ('B' if segment.bold else '') + ('I' if segment.italic else '')
+        if texts and segment_style == style:
+            texts.append(' ' * blanks)
+        else:
+            if texts:
+                pieces.append((start, style, ''.join(texts)))
+            texts = []
+            start = column + blanks
+            style = segment_style
+        column += blanks + len(text)
+        blanks = 0
+        texts.append(text)
+    if texts:
+        pieces.append((start, style, ''.join(texts)))
+    return pieces
+
+def wrap_columns(text, width):
+    """(start, end) ranges of `text` wrapped at `width` columns.
+
+    Same breaks as fpdf's write(): after the last space that fits (the
+    space itself is dropped), or inside a word longer than a line.
+    """
+    ranges = []
+    start = 0
+    while len(text) - start > width:
+        end = start + width
+        space = text.rfind(' ', start, end + 1)
+        if space > start:
+            ranges.append((start, space))
+            start = space + 1
+        else:
+            ranges.append((start, end))
+            start = end
+    ranges.append((start, len(text)))
+    return ranges
+
+def pdf_wrapped_pieces(row, max_columns):
+    """pdf_row_pieces for each printed line of `row`.
+
+    Reflow keeps rows within the page whenever it can; the few that are
+    still too wide (a single very long line) wrap onto extra lines.
+    """
+    if row.length <= max_columns:
+        return [pdf_row_pieces(row)]
+    lines = []
+    for start, end in wrap_columns(row.text, max_columns):
+        segments = []
+        position = 0
+        for segment in row:
+            segment_end = position + len(segment.text)
+            if segment_end > start and position < end:
+                text = segment.text[max(start - position, 0):end - position]
+                segments.append(segment._replace(text=text))
+            position = segment_end
+        lines.append(pdf_row_pieces(segments))
+    return lines
+
+def draw_pdf_song(pdf, layout):
+    """Draw one song starting at the top of the current page of `pdf`."""
     # Title: Bold + Underline
     pdf.set_font('Helvetica', 'BU', 14)
     # Reduced height from 7 to 5 to bring artist closer
-    pdf.cell(0, 5, title, new_x="LMARGIN", new_y="NEXT", align='C')
+    pdf.cell(0, 5, layout.title, new_x="LMARGIN", new_y="NEXT", align='C')
     
     pdf.set_font('Helvetica', '', 10)
-    pdf.cell(0, 7, artist, new_x="LMARGIN", new_y="NEXT", align='C')
-    
-    # Header height calculation (Key removed)
-    header_height = 15 # Adjusted base height
-    
-    usable_width = 200
-    usable_height = 287 - header_height
-    
-    font_size, reflowed_lines, line_height = calculate_layout(lines, usable_height, usable_width)
+    pdf.cell(0, 7, layout.artist, new_x="LMARGIN", new_y="NEXT", align='C')
     
-    pdf.set_font('Courier', '', font_size)
-    
-    initial_y = pdf.get_y()
-    pdf.set_xy(5, initial_y)
-    
-    for line_segments in reflowed_lines:
-        pdf.set_x(5)
-        for segment in line_segments:
-            text = segment['text']
-            is_bold = segment['bold']
-            is_italic = segment.get('italic', False)
-            
-            style = ''
-            if is_bold: style += 'B'
-            if is_italic: style += 'I'
-            
-            pdf.set_font('Courier', style, font_size)
-            pdf.write(line_height, text)
-        pdf.ln(line_height)
+    font_size = layout.font_size
+    line_height = layout.line_height
+    # Courier is monospaced: every column is 0.6 em wide, so each piece of
+    # a row can be placed directly instead of writing its padding spaces.
+    char_width = COURIER_CHAR_WIDTH * font_size / pdf.k
+    # Same baseline as pdf.write(line_height, ...) inside a row
+    baseline = 0.5 * line_height + 0.3 * font_size / pdf.k
 
-    # Return bytes
-    return pdf.output(dest='S')
+    # pdf.write starts one cell margin in from the page margin
+    left = pdf.l_margin + pdf.c_margin
+    max_columns = int((pdf.w - pdf.r_margin - pdf.l_margin - 2 * pdf.c_margin) / char_width + 1e-9)
+    y = pdf.get_y()
+    style = None
+    for row in layout.rows:
+        for pieces in pdf_wrapped_pieces(row, max_columns):
+            if y + line_height > pdf.page_break_trigger:
+                pdf.add_page()
+                y = pdf.get_y()
+                style = None
+            for column, piece_style, text in pieces:
+                if piece_style != style:
+                    pdf.set_font('Courier', piece_style, font_size)
+                    style = piece_style
+                pdf.text(left + column * char_width, y + baseline, text)
+            y += line_height
+    pdf.set_xy(pdf.l_margin, y)
 
-def generate_docx_bytes(title, artist, key, lines):
-    usable_width = 200
-    usable_height = 270
-    font_size, reflowed_lines, line_height = calculate_layout(lines, usable_height, usable_width)
-    
-    doc = Document()
-    
-    sections = doc.sections
-    for section in sections:
-        section.orientation = WD_ORIENT.PORTRAIT
-        section.page_width = Cm(21)
-        section.page_height = Cm(29.7)
-        section.top_margin = Cm(0.5)
-        section.bottom_margin = Cm(0.5)
-        section.left_margin = Cm(0.5)
-        section.right_margin = Cm(0.5)
-
-    p_title = doc.add_paragraph()
-    p_title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-    # Remove space after title to bring artist closer
-    p_title.paragraph_format.space_after = Pt(0)
-    
-    run_title = p_title.add_run(title)
-    run_title.bold = True
-    run_title.underline = True
-    run_title.font.name = 'Helvetica'
-    run_title.font.size = Pt(14)
-
-    p_artist = doc.add_paragraph()
-    p_artist.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-    run_artist = p_artist.add_run(artist)
-    run_artist.font.name = 'Helvetica'
-    run_artist.font.size = Pt(10)
-    
+def render_pdf(layout, stream=None):
+    pdf = new_pdf()
+    pdf.add_page()
+    draw_pdf_song(pdf, layout)
+    # Return bytes, or write them into `stream`
+    return pdf.output(stream)
+
+def new_docx():
+    return DocxWriter()
+
+def add_docx_song(doc, layout):
+    """Append one song to `doc`; callers add page breaks between songs."""
+    doc.add_paragraph(layout.title, 'Titulo')
+    doc.add_paragraph(layout.artist, 'Artista')
     # Key (Tom) section removed
-    
-    font_name = 'Courier New'
-    
-    font_name = 'Courier New'
-    
-    for line_segments in reflowed_lines:
-        p = doc.add_paragraph()
-        p.paragraph_format.space_after = Pt(0)
-        p.paragraph_format.line_spacing = 1
-        
-        for segment in line_segments:
-            text = segment['text']
-            is_bold = segment['bold']
-            is_italic = segment.get('italic', False)
-            
-            run = p.add_run(text)
-            run.font.name = font_name
-            run.font.size = Pt(font_size)
-            run.bold = is_bold
-            run.italic = is_italic
-
-    # Return bytes
-    f = io.BytesIO()
-    doc.save(f)
-    f.seek(0)
-    return f.read()
+    doc.add_chart(layout.rows, layout.font_size)
 
-def get_content_from_file(filepath):
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except Exception as e:
-        raise Exception(f"Erro ao ler o arquivo: {e}")
+def save_docx(doc, stream=None):
+    return doc.save(stream)
+
+def render_docx(layout, stream=None):
+    doc = new_docx()
+    add_docx_song(doc, layout)
+    # Return bytes, or write them into `stream`
+    return save_docx(doc, stream)
+
+def _write_output(data, stream):
+    if stream is not None:
+        stream.write(data)
+        return None
+    return data
 
+# Preview formats: the reflowed rows as they appear in the documents,
+# cheap enough to rebuild on every key change in the browser.
+def render_txt(layout, stream=None):
+    parts = [layout.title, layout.artist, '']
+    parts.extend(row.text for row in layout.rows)
+    return _write_output(("\n".join(parts) + "\n").encode('utf-8'), stream)
+
+def _html_row(row):
+    parts = []
+    for segment in row:
+        text = html.escape(segment.text, quote=False)
+        if segment.italic:
+            text = f"<i>{text}</i>"
+        if segment.bold:
+            text = f"<b>{text}</b>"
+        parts.append(text)
+    return "".join(parts)
+
+def render_html(layout, stream=None):
+    """HTML fragment: chords in <b>, repeated section headers in <i>."""
+    rows = "\n".join(_html_row(row) for row in layout.rows)
+    data = (
+        '<article class="cifra">\n'
+        f'<h1>{html.escape(layout.title)}</h1>\n'
+        f'<h2>{html.escape(layout.artist)}</h2>\n'
+        f'<pre style="font-size: {layout.font_size}pt">{rows}</pre>\n'
+        '</article>\n'
+    )
+    return _write_output(data.encode('utf-8'), stream)
+
+def layout_to_data(layout):
+    return {
+        'title': layout.title,
+        'artist': layout.artist,
+        'key': layout.key,
+        'font_size': layout.font_size,
+        'rows': [[[s.text, s.bold, s.italic] for s in row.segments] for row in layout.rows],
+    }
+
+def render_json(layout, stream=None):
+    data = json.dumps(layout_to_data(layout), ensure_ascii=False)
+    return _write_output(data.encode('utf-8'), stream)
+
+# Output formats: each renderer takes a Layout and returns the file bytes,
+# or writes them into the file object passed as `stream` and returns None.
+RENDERERS = {
+    'pdf': render_pdf,
+    'docx': render_docx,
+    'txt': render_txt,
+    'html': render_html,
+    'json': render_json,
+}
+
+PREVIEW_FORMATS = ('html', 'json', 'txt')
+
+MIMETYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'zip': 'application/zip',
+    'txt': 'text/plain',
+    'html': 'text/html',
+    'json': 'application/json',
+    # lib.songpack binary song, see /api/song
+    'song': 'application/octet-stream',
+}
+
+def render(layout, format_type, stream=None):
+    renderer = RENDERERS.get(format_type)
+    if renderer is None:
+        raise ValueError(f"Formato inválido: {format_type}")
+    with span('render'):
+        return renderer(layout, stream)
+
+def render_zip(layout, base_filename, formats=('pdf', 'docx'), stream=None):
+    """Render several formats from the same layout into one zip archive.
+
+    Each document is written straight into its archive member; the archive
+    goes into `stream` when given, otherwise its bytes are returned.
+    """
+    f = io.BytesIO() if stream is None else stream
+    # The documents are already compressed, deflating them again only costs CPU
+    with zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED) as archive:
+        for format_type in formats:
+            info = zipfile.ZipInfo(f"{base_filename}.{format_type}", DOCUMENT_DATE.timetuple()[:6])
+            with archive.open(info, 'w') as member:
+                render(layout, format_type, member)
+    return f.getvalue() if stream is None else None
+
+def safe_filename(title, artist):
+    # Sanitize filename
+    safe_title = "".join([c for c in title if c.isalpha() or c.isdigit() or c==' ']).rstrip()
+    safe_artist = "".join([c for c in artist if c.isalpha() or c.isdigit() or c==' ']).rstrip()
+    return f"{safe_title}_{safe_artist}".replace(" ", "_")
+
+# Everything besides the song that changes the output of layout_song and
+# the renderers; part of every render cache key.
+LAYOUT_PARAMS = (USABLE_WIDTH, USABLE_HEIGHT, FONT_SIZE_MAX, FONT_SIZE_MIN, FONT_SIZE_STEP, UNIT_GAP)
+
+# Final document bytes plus their strong ETag (sha256 of the bytes).
+RenderedDocument = namedtuple('RenderedDocument', ['data', 'etag'])
+
+_render_cache = build_render_cache(size_of=lambda document: len(document.data))
+
+# CIFRA_EXECUTOR=process moves transpose/layout/render (pure Python, so
+# serialized by the GIL under a threaded server) to a pool of warm worker
+# processes; CIFRA_EXECUTOR_WORKERS sets its size (default: CPU count).
+RENDER_EXECUTOR = os.environ.get('CIFRA_EXECUTOR', 'inline')
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def _render_pool_workers():
+    return env_number('CIFRA_EXECUTOR_WORKERS', os.cpu_count() or 1)
+
+def get_render_pool():
+    """The render process pool, created on first use; None unless enabled."""
+    global _render_pool
+    # Spawned workers re-import the main module; they must not start pools
+    if RENDER_EXECUTOR != 'process' or not is_main_process():
+        return None
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = build_process_pool(_render_pool_workers())
+        return _render_pool
+
+def start_render_pool():
+    """Create and warm up the render pool at startup when it is enabled."""
+    pool = get_render_pool()
+    if pool is not None:
+        warm_pool(pool, _render_pool_workers())
+
+def _reset_render_pool(pool):
+    """Shut down the broken `pool` so the next render starts a fresh one."""
+    global _render_pool
+    with _render_pool_lock:
+        # Another thread may already have replaced it
+        if _render_pool is pool:
+            _render_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def render_cache_stats():
+    return _render_cache.stats()
+
+def song_digest(song):
+    return _digest_encoded(song_to_bytes(song))
+
+def _digest_encoded(encoded_song):
+    return hashlib.sha256(encoded_song).hexdigest()
+
+def _render_document(song, target_key_index, format_type):
+    title, artist, key, lines = transpose_song(song, target_key_index)
+    layout = layout_song(title, artist, key, lines)
+    if format_type == 'zip':
+        data = render_zip(layout, safe_filename(title, artist))
+    else:
+        data = bytes(render(layout, format_type))
+    return RenderedDocument(data, hashlib.sha256(data).hexdigest())
+
+def _render_encoded_document(encoded_song, target_key_index, format_type):
+    # Runs in the render pool; the song crosses the process boundary packed
+    return _render_document(song_from_bytes(encoded_song), target_key_index, format_type)
+
+def render_song(song, target_key_index, format_type):
+    """Transpose, lay out and render `song`, going through the render cache.
+
+    `song` is the untransposed song from load_cifra; the cache key is its
+    content hash with the target key, the format and LAYOUT_PARAMS, so a
+    page that changes upstream gets new documents. `format_type` is one of
+    RENDERERS or 'zip' (all of them).
+    """
+    if format_type not in RENDERERS and format_type != 'zip':
+        raise ValueError(f"Formato inválido: {format_type}")
+    encoded_song = song_to_bytes(song)
+    cache_key = f"{_digest_encoded(encoded_song)}:{target_key_index}:{format_type}:{LAYOUT_PARAMS}"
+    document = _render_cache.get(cache_key)
+    if document is not None:
+        return document
+
+    pool = get_render_pool()
+    if pool is None:
+        document = _render_document(song, target_key_index, format_type)
+    else:
+        try:
+            with span('render_pool'):
+                document = pool.submit(_render_encoded_document, encoded_song, target_key_index, format_type).result()
+        except BrokenProcessPool as e:
+            print(f"WARN: render pool failed ({e}), rendering in process.", file=sys.stderr)
+            _reset_render_pool(pool)
+            document = _render_document(song, target_key_index, format_type)
+    _render_cache.set(cache_key, document)
+    return document
+
+def generate_document(url, target_key_index, format_type):
+    """Fetch (through the song cache) and render one song.
+
+    Returns (base filename, RenderedDocument); the unit of work of both
+    /api/generate and its background jobs.
+    """
+    key = (normalize_song_url(url), target_key_index, format_type)
+    return _generations.do(key, _generate_document, url, target_key_index, format_type)
+
+def _generate_document(url, target_key_index, format_type):
+    song = load_cifra(url)
+    return safe_filename(song.title, song.artist), render_song(song, target_key_index, format_type)
+
+def generate_pdf_bytes(title, artist, key, lines):
+    return render_pdf(layout_song(title, artist, key, lines))
+
+def generate_docx_bytes(title, artist, key, lines):
+    return render_docx(layout_song(title, artist, key, lines))
+
+def song_from_text_lines(raw_lines):
+    """Song from the lines of a plain-text chart.
+
+    The first two lines are the title and the artist unless they look like
+    chords; a "Tom:" line shortly after them gives the key.
+    """
     lines = []
-    raw_lines = content.splitlines()
     
     title = "Título Desconhecido"
     artist = "Artista Desconhecido"
     key = ""
     
     start_index = 0
-    if len(raw_lines) > 0 and not is_chord_line([{'text': raw_lines[0], 'bold': False}]):
+    if len(raw_lines) > 0 and not is_chord_text(raw_lines[0].strip()):
         title = raw_lines[0].strip()
         start_index += 1
-    if len(raw_lines) > 1 and not is_chord_line([{'text': raw_lines[1], 'bold': False}]):
+    if len(raw_lines) > 1 and not is_chord_text(raw_lines[1].strip()):
         artist = raw_lines[1].strip()
         start_index += 1
         
@@ -537,11 +1092,64 @@ def get_content_from_file(filepath):
 
     for i in range(start_index, len(raw_lines)):
         text = raw_lines[i].rstrip()
-        temp_segments = [{'text': text, 'bold': False}]
-        
-        if is_chord_line(temp_segments):
-            lines.append([{'text': text, 'bold': True}])
-        else:
-            lines.append([{'text': text, 'bold': False}])
+        lines.append(Line([Segment(text, is_chord_text(text.strip()))]))
             
-    return title, artist, key, lines
+    return make_song(title, artist, key, lines)
+
+def get_content_from_file(filepath):
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            content = f.read()
+    except Exception as e:
+        raise Exception(f"Erro ao ler o arquivo: {e}")
+
+    return song_from_text_lines(content.splitlines())
+
+# A line made only of ---, ===, ***, ___ or ~~~ (3 or more), or a form
+# feed, separates two songs in a concatenated export.
+SONG_DELIMITER_RE = re.compile(r'^\s*(?:-{3,}|={3,}|\*{3,}|_{3,}|~{3,}|\f)\s*$')
+
+def split_song_blocks(text_lines, title_marker=None):
+    """Group a stream of text lines into the raw lines of each song.
+
+    Songs end at a delimiter line (SONG_DELIMITER_RE) or, with
+    `title_marker` (e.g. "Título:"), where a line starting with the marker
+    opens the next song; the rest of that line is its title. Blank lines
+    around a song are dropped. Only the current song is held in memory.
+    """
+    block = []
+    for raw_line in text_lines:
+        line = raw_line.rstrip('\r\n')
+        if SONG_DELIMITER_RE.match(line):
+            starts_song, line = True, None
+        elif title_marker and line.lstrip().startswith(title_marker):
+            starts_song, line = True, line.lstrip()[len(title_marker):].strip()
+        else:
+            starts_song = False
+        if starts_song:
+            while block and not block[-1].strip():
+                block.pop()
+            if block:
+                yield block
+            block = []
+            if line is None:
+                continue
+        if block or line.strip():
+            block.append(line)
+    while block and not block[-1].strip():
+        block.pop()
+    if block:
+        yield block
+
+def iter_songs(text_lines, title_marker=None):
+    """Parse songs one at a time from any iterable of lines (file, stdin)."""
+    for block in split_song_blocks(text_lines, title_marker):
+        yield song_from_text_lines(block)
+
+def iter_songs_from_file(filepath, title_marker=None):
+    """Stream the songs of a (possibly huge) multi-song .txt export."""
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            yield from iter_songs(f, title_marker)
+    except (OSError, UnicodeDecodeError) as e:
+        raise Exception(f"Erro ao ler o arquivo: {e}")
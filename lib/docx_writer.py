@@ -0,0 +1,176 @@
+"""Small DOCX writer for the song documents.
+
+Writes the WordprocessingML parts directly instead of going through
+python-docx: the formatting lives in a handful of paragraph styles
+defined once in styles.xml, each chart row is one paragraph and adjacent
+segments with the same bold/italic state share one run. The package only
+holds the parts Word needs, with fixed timestamps, so the same document
+always produces the same bytes.
+"""
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+# Page geometry in twentieths of a point: A4 portrait, 0.5 cm margins
+PAGE_WIDTH = 11906
+PAGE_HEIGHT = 16838
+PAGE_MARGIN = 283
+
+CHART_FONT = 'Courier New'
+HEADING_FONT = 'Helvetica'
+
+# Characters XML 1.0 does not allow, even escaped
+_INVALID_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+
+PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+def _fonts(name):
+    return f'<w:rFonts w:ascii="{name}" w:hAnsi="{name}" w:cs="{name}"/>'
+
+# Same defaults as the python-docx template the documents used to start from
+_BASE_STYLES = (
+    '<w:docDefaults>'
+    '<w:rPrDefault><w:rPr>' + _fonts('Calibri') + '<w:sz w:val="22"/><w:szCs w:val="22"/>'
+    '<w:lang w:val="pt-BR"/></w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="200" w:line="276" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+    '<w:style w:type="paragraph" w:customStyle="1" w:styleId="Titulo"><w:name w:val="Titulo"/>'
+    '<w:basedOn w:val="Normal"/><w:pPr><w:spacing w:after="0"/><w:jc w:val="center"/></w:pPr>'
+    '<w:rPr>' + _fonts(HEADING_FONT) + '<w:b/><w:sz w:val="28"/><w:u w:val="single"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:customStyle="1" w:styleId="Artista"><w:name w:val="Artista"/>'
+    '<w:basedOn w:val="Normal"/><w:pPr><w:jc w:val="center"/></w:pPr>'
+    '<w:rPr>' + _fonts(HEADING_FONT) + '<w:sz w:val="20"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:customStyle="1" w:styleId="Indice"><w:name w:val="Indice"/>'
+    '<w:basedOn w:val="Normal"/><w:pPr><w:spacing w:after="0"/></w:pPr>'
+    '<w:rPr>' + _fonts(HEADING_FONT) + '<w:sz w:val="22"/></w:rPr></w:style>'
+)
+
+def _chart_style(half_points):
+    size = half_points / 2
+    return (
+        f'<w:style w:type="paragraph" w:customStyle="1" w:styleId="{chart_style_id(half_points)}">'
+        f'<w:name w:val="Cifra {size:g}"/><w:basedOn w:val="Normal"/>'
+        '<w:pPr><w:spacing w:after="0" w:line="240" w:lineRule="auto"/></w:pPr>'
+        f'<w:rPr>{_fonts(CHART_FONT)}<w:sz w:val="{half_points}"/><w:szCs w:val="{half_points}"/></w:rPr>'
+        '</w:style>'
+    )
+
+def chart_style_id(half_points):
+    return f'Cifra{half_points}'
+
+def _text(text):
+    return escape(_INVALID_XML_RE.sub('', text))
+
+def _run(text, bold=False, italic=False):
+    props = ('<w:b/>' if bold else '') + ('<w:i/>' if italic else '')
+    if props:
+        props = f'<w:rPr>{props}</w:rPr>'
+    return f'<w:r>{props}<w:t xml:space="preserve">{_text(text)}</w:t></w:r>'
+
+def _chart_runs(segments):
+    """Runs for one row, adjacent segments with the same style merged."""
+    runs = []
+    texts = []
+    style = None
+    for segment in segments:
+        if not segment.text:
+            continue
+        current = (segment.bold, segment.italic)
+        if current != style and texts:
+            runs.append(_run(''.join(texts), *style))
+            texts = []
+        style = current
+        texts.append(segment.text)
+    if texts:
+        runs.append(_run(''.join(texts), *style))
+    return ''.join(runs)
+
+class DocxWriter:
+    """Accumulates body paragraphs; save() packages the document."""
+
+    def __init__(self):
+        self._body = []
+        self._chart_sizes = set()
+
+    def add_paragraph(self, text, style='Normal'):
+        self._body.append(f'<w:p><w:pPr><w:pStyle w:val="{style}"/></w:pPr>{_run(text) if text else ""}</w:p>')
+
+    def add_page_break(self):
+        self._body.append('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+
+    def add_chart(self, rows, font_size):
+        """One single-spaced monospace paragraph per row of Segments."""
+        half_points = int(round(font_size * 2))
+        self._chart_sizes.add(half_points)
+        prefix = f'<w:p><w:pPr><w:pStyle w:val="{chart_style_id(half_points)}"/></w:pPr>'
+        self._body.extend(prefix + _chart_runs(row) + '</w:p>' for row in rows)
+
+    def document_xml(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<w:document xmlns:w="{_W_NS}"><w:body>'
+            + ''.join(self._body) +
+            f'<w:sectPr><w:pgSz w:w="{PAGE_WIDTH}" w:h="{PAGE_HEIGHT}"/>'
+            f'<w:pgMar w:top="{PAGE_MARGIN}" w:right="{PAGE_MARGIN}" w:bottom="{PAGE_MARGIN}" '
+            f'w:left="{PAGE_MARGIN}" w:header="720" w:footer="720" w:gutter="0"/></w:sectPr>'
+            '</w:body></w:document>'
+        )
+
+    def styles_xml(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<w:styles xmlns:w="{_W_NS}">'
+            + _BASE_STYLES
+            + ''.join(_chart_style(size) for size in sorted(self._chart_sizes)) +
+            '</w:styles>'
+        )
+
+    def save(self, stream=None):
+        """Write the .docx into `stream`, or return its bytes."""
+        f = io.BytesIO() if stream is None else stream
+        parts = (
+            ('[Content_Types].xml', CONTENT_TYPES),
+            ('_rels/.rels', PACKAGE_RELS),
+            ('word/_rels/document.xml.rels', DOCUMENT_RELS),
+            ('word/styles.xml', self.styles_xml()),
+            ('word/document.xml', self.document_xml()),
+        )
+        with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, content in parts:
+                info = zipfile.ZipInfo(name, _ZIP_DATE)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, content.encode('utf-8'))
+        return f.getvalue() if stream is None else None
@@ -0,0 +1,258 @@
+"""Fast extraction of the parts of a Cifra Club page we actually use.
+
+Instead of building a DOM for the whole page (ads, scripts, navigation),
+regular expressions locate h1.t1, h2.t3, span#cifra_tom and the first
+<pre>, and the stdlib HTMLParser only tokenizes those slices. The result
+mirrors what the BeautifulSoup path in cifra_logic reads; extract_cifra
+returns None whenever the page does not look the way we expect, so the
+caller can fall back to BeautifulSoup.
+"""
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+
+# title/artist/key are None when the element is missing. `pre` is a list
+# of ('text', str), ('b', str) and ('br', None) events for the direct
+# children of the <pre> tag, in document order.
+Extracted = namedtuple('Extracted', ['title', 'artist', 'key', 'pre'])
+
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr',
+])
+
+_SKIPPED_RE = re.compile(r'<script\b.*?</script\s*>|<style\b.*?</style\s*>|<!--.*?-->', re.I | re.S)
+_ATTR_RE = re.compile(r'''([^\s=/>]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]+))?''')
+_CHARSET_RE = re.compile(rb'''<meta[^>]+charset\s*=\s*["']?([\w.:-]+)''', re.I)
+
+def _decode(content):
+    if isinstance(content, str):
+        return content
+    if content.startswith(b'\xef\xbb\xbf'):
+        return content[3:].decode('utf-8')
+    match = _CHARSET_RE.search(content, 0, 4096)
+    encoding = match.group(1).decode('ascii') if match else 'utf-8'
+    return content.decode(encoding)
+
+def _attrs(tag_text):
+    attrs = {}
+    # Skip "<name" before reading attributes
+    body = tag_text[1:-1].split(None, 1)
+    if len(body) == 2:
+        for name, value in _ATTR_RE.findall(body[1]):
+            if value[:1] in ('"', "'"):
+                value = value[1:-1]
+            attrs.setdefault(name.lower(), value)
+    return attrs
+
+class _Document:
+    def __init__(self, html):
+        self.html = html
+        self._skipped = [m.span() for m in _SKIPPED_RE.finditer(html)]
+
+    def _is_skipped(self, pos):
+        for start, end in self._skipped:
+            if start > pos:
+                return False
+            if pos < end:
+                return True
+        return False
+
+    def find(self, tag, predicate=None):
+        """Offset of the first <tag> (outside scripts/comments) matching predicate."""
+        for match in re.finditer(r'<%s\b[^>]*>' % tag, self.html, re.I):
+            if self._is_skipped(match.start()):
+                continue
+            if predicate is None or predicate(_attrs(match.group(0))):
+                return match.start()
+        return None
+
+class _ElementParser(HTMLParser):
+    """Feeds from the opening tag of an element until it closes.
+
+    End tags close the innermost open element with that name (and anything
+    left open inside it); end tags with no open element are ignored, as
+    BeautifulSoup's html.parser builder does.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = None
+        self.open_tags = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if self.root is None:
+            self.root = tag
+            self.open_tags.append(tag)
+            return
+        if tag not in VOID_ELEMENTS:
+            self.open_tags.append(tag)
+        self.element_start(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if self.done:
+            return
+        if self.root is None:
+            self.root = tag
+            self.done = True
+            return
+        self.element_start(tag)
+        if tag not in VOID_ELEMENTS:
+            self.element_end(tag)
+
+    def handle_endtag(self, tag):
+        if self.done or tag not in self.open_tags:
+            return
+        while self.open_tags:
+            closed = self.open_tags.pop()
+            if not self.open_tags:
+                self.done = True
+                return
+            self.element_end(closed)
+            if closed == tag:
+                return
+
+    def element_start(self, tag):
+        pass
+
+    def element_end(self, tag):
+        pass
+
+class _TextParser(_ElementParser):
+    """Equivalent of BeautifulSoup's get_text(strip=True)."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+
+    def handle_data(self, data):
+        if not self.done and self.root is not None:
+            data = data.strip()
+            if data:
+                self.parts.append(data)
+
+class _PreParser(_ElementParser):
+    """Events for the direct children of <pre>: text, bold chords and <br>.
+
+    Other child tags are skipped with their content, like the BeautifulSoup
+    loop in parse_cifra_html does.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.events = []
+        self._text = []
+        self._bold = None
+        self._bold_depth = 0
+        self._skip_depth = 0
+
+    def _flush(self):
+        if self._text:
+            self.events.append(('text', ''.join(self._text)))
+            self._text = []
+
+    # Any tag ends the current text node, even one that is ignored
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        super().handle_starttag(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+        super().handle_startendtag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._flush()
+        super().handle_endtag(tag)
+
+    def element_start(self, tag):
+        if self._skip_depth:
+            if tag not in VOID_ELEMENTS:
+                self._skip_depth += 1
+        elif self._bold is not None:
+            if tag == 'b':
+                self._bold_depth += 1
+        elif tag == 'b':
+            self._bold = []
+            self._bold_depth = 1
+        elif tag == 'br':
+            self.events.append(('br', None))
+        elif tag not in VOID_ELEMENTS:
+            self._skip_depth = 1
+
+    def element_end(self, tag):
+        if self._skip_depth:
+            self._skip_depth -= 1
+        elif self._bold is not None and tag == 'b':
+            self._bold_depth -= 1
+            if self._bold_depth == 0:
+                self.events.append(('b', ''.join(self._bold)))
+                self._bold = None
+
+    def handle_data(self, data):
+        if self.done or self.root is None or self._skip_depth:
+            return
+        if self._bold is not None:
+            self._bold.append(data)
+        else:
+            self._text.append(data)
+
+    def handle_comment(self, data):
+        # BeautifulSoup keeps comments as strings, so they end up as text
+        if self.done or self.root is None or self._skip_depth or self._bold is not None:
+            return
+        self._flush()
+        self.events.append(('text', data))
+
+    def close(self):
+        super().close()
+        if self._bold is not None:
+            self.events.append(('b', ''.join(self._bold)))
+            self._bold = None
+        self._flush()
+
+def _parse_from(html, start, end_tag, parser):
+    # Feed up to each candidate closing tag until the element is closed, so
+    # only the element itself is tokenized even when it nests its own tag.
+    pos = start
+    while not parser.done and pos < len(html):
+        end = html.find(end_tag, pos)
+        end = len(html) if end == -1 else html.find('>', end) + 1 or len(html)
+        parser.feed(html[pos:end])
+        pos = end
+    parser.close()
+    return parser
+
+def _element_text(doc, tag, predicate):
+    start = doc.find(tag, predicate)
+    if start is None:
+        return None
+    return ''.join(_parse_from(doc.html, start, f'</{tag}', _TextParser()).parts)
+
+def _has_class(name):
+    return lambda attrs: name in attrs.get('class', '').split()
+
+def extract_cifra(content):
+    """Extract title, artist, key and <pre> events, or None if unsure."""
+    try:
+        html = _decode(content)
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+    doc = _Document(html)
+    pre_start = doc.find('pre')
+    if pre_start is None:
+        return None
+
+    pre = _parse_from(html, pre_start, '</pre', _PreParser())
+    if not pre.done:
+        return None
+
+    return Extracted(
+        _element_text(doc, 'h1', _has_class('t1')),
+        _element_text(doc, 'h2', _has_class('t3')),
+        _element_text(doc, 'span', lambda attrs: attrs.get('id') == 'cifra_tom'),
+        pre.events,
+    )
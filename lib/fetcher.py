@@ -0,0 +1,95 @@
+import threading
+from collections import namedtuple
+
+from lib.settings import env_number
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Worst case is (MAX_RETRIES + 1) * (CONNECT_TIMEOUT + READ_TIMEOUT) plus
+# backoff, which must stay under the 30s maxDuration of the Vercel function.
+CONNECT_TIMEOUT = env_number('CIFRA_CONNECT_TIMEOUT', 3.05, float)
+READ_TIMEOUT = env_number('CIFRA_READ_TIMEOUT', 6, float)
+MAX_RETRIES = env_number('CIFRA_MAX_RETRIES', 2)
+BACKOFF_FACTOR = 0.3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Keep-alive connections shared by every fetch, including the concurrent
+# ones of a songbook.
+HTTP_POOL_SIZE = 16
+
+# Result of a (possibly conditional) GET. When not_modified is True the
+# server answered 304 and content is None.
+FetchResult = namedtuple('FetchResult', ['content', 'etag', 'last_modified', 'not_modified'])
+
+stats = {'requests': 0, 'not_modified': 0, 'errors': 0}
+_stats_lock = threading.Lock()
+
+def _count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+def build_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        # Retry-After can ask for minutes (urllib3 honours up to 6h), far past
+        # the time budget above; retries only use the short backoff
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry))
+    return session
+
+# Built on the first fetch: requests/urllib3 are not needed by requests
+# served from the song cache.
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = build_session()
+        return _session
+
+def fetch(url, etag=None, last_modified=None):
+    """GET `url` on the shared session, revalidating when validators are given.
+
+    Pass the ETag/Last-Modified of a previously fetched copy to send
+    If-None-Match/If-Modified-Since; a 304 comes back as not_modified.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    import requests
+
+    session = get_session()
+    _count('requests')
+    try:
+        response = session.get(url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        if response.status_code == 304:
+            _count('not_modified')
+            return FetchResult(None, etag, last_modified, True)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        _count('errors')
+        raise Exception(f"Erro ao acessar a URL: {e}")
+
+    return FetchResult(
+        response.content,
+        response.headers.get('ETag'),
+        response.headers.get('Last-Modified'),
+        False,
+    )
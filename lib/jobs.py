@@ -0,0 +1,202 @@
+"""Background jobs for generations that should not hold the request open.
+
+A JobQueue hands work to an executor and keeps the outcome in memory
+under a random job id until it expires. Clients poll (or long-poll with a
+timeout) for the status and fetch the result once it is done. The number
+of unfinished jobs is capped: past it submit raises QueueFull so the API
+can answer 503 instead of queueing work it cannot finish in time.
+
+Jobs live in the memory of the process that accepted them, so the
+polling requests must reach the same process (self-hosted deployments).
+"""
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait
+
+from lib.settings import env_number
+
+DEFAULT_JOB_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 32
+DEFAULT_RESULT_TTL = 10 * 60       # seconds
+MAX_STORED_JOBS = 1000
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'error'
+
+class QueueFull(Exception):
+    pass
+
+class InlineExecutor:
+    """Runs submitted work right away in the calling thread.
+
+    Stand-in for the thread pool in tests and scripts: a job is already
+    finished when submit returns.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+class Job:
+    def __init__(self, job_id, future, info=None):
+        self.id = job_id
+        self.future = future
+        # Caller data kept with the job (e.g. the requested format)
+        self.info = info or {}
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def status(self):
+        if self.future.done():
+            return FAILED if self.future.exception() is not None else DONE
+        return RUNNING if self.future.running() else PENDING
+
+    @property
+    def result(self):
+        """Return value of the job's function; only valid once DONE."""
+        return self.future.result()
+
+    @property
+    def error(self):
+        if self.future.done() and self.future.exception() is not None:
+            return str(self.future.exception())
+        return None
+
+    def wait(self, timeout):
+        """Block up to `timeout` seconds for the job to finish."""
+        wait([self.future], timeout)
+        return self.future.done()
+
+    def to_dict(self):
+        data = {'id': self.id, 'status': self.status}
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+class JobQueue:
+    def __init__(self, executor, max_pending=DEFAULT_QUEUE_SIZE, result_ttl=DEFAULT_RESULT_TTL):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.submitted = 0
+        self.rejected = 0
+        self._pending = 0
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            expired = job.finished_at is not None and now - job.finished_at > self.result_ttl
+            if expired or (len(self._jobs) > MAX_STORED_JOBS and job.finished_at is not None):
+                del self._jobs[job_id]
+
+    def submit(self, fn, *args, info=None):
+        """Queue fn(*args) and return its Job; raises QueueFull under load."""
+        with self._lock:
+            self._expire()
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull("Fila de processamento cheia, tente novamente em instantes.")
+            self._pending += 1
+            self.submitted += 1
+
+        job_id = uuid.uuid4().hex
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        job = Job(job_id, future, info)
+        with self._lock:
+            self._jobs[job_id] = job
+        future.add_done_callback(lambda _: self._finished(job))
+        return job
+
+    def _finished(self, job):
+        with self._lock:
+            job.finished_at = time.time()
+            self._pending -= 1
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'stored': len(self._jobs),
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+            }
+
+def is_main_process():
+    """False inside pool workers, also while spawn is still re-importing the
+    main module there (parent_process() is only set after that import).
+    """
+    return multiprocessing.current_process().name == 'MainProcess'
+
+def warm_worker():
+    """Process pool initializer: pay for the heavy imports before any job."""
+    from lib.cifra_logic import preload_dependencies
+    preload_dependencies()
+
+def _noop():
+    return os.getpid()
+
+def build_process_pool(workers):
+    # spawn rather than fork: the parent is a threaded server holding locks
+    # and sockets that a forked child must not inherit
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=warm_worker,
+    )
+
+def warm_pool(pool, workers):
+    """Start every worker now instead of on the first requests."""
+    for future in [pool.submit(_noop) for _ in range(workers)]:
+        future.result()
+
+def build_executor(backend, workers):
+    if backend == 'inline':
+        return InlineExecutor()
+    if backend == 'thread':
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cifra-job')
+    raise ValueError(f"Backend de jobs inválido: {backend}")
+
+def build_job_queue():
+    """Create the job queue from environment settings.
+
+    CIFRA_JOB_BACKEND       'thread' (default) or 'inline' (runs in the request)
+    CIFRA_JOB_WORKERS       worker threads (default 4)
+    CIFRA_JOB_QUEUE_SIZE    max unfinished jobs before QueueFull (default 32)
+    CIFRA_JOB_TTL           seconds a finished job is kept (default 600)
+    """
+    executor = build_executor(
+        os.environ.get('CIFRA_JOB_BACKEND', 'thread'),
+        env_number('CIFRA_JOB_WORKERS', DEFAULT_JOB_WORKERS),
+    )
+    return JobQueue(
+        executor,
+        env_number('CIFRA_JOB_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+        env_number('CIFRA_JOB_TTL', DEFAULT_RESULT_TTL),
+    )
@@ -0,0 +1,292 @@
+"""Persistent, searchable library of charts.
+
+Songs from .txt files (get_content_from_file) and from Cifra Club pages
+are stored in SQLite with an FTS5 index over title, artist, lyrics and
+the chord progression written as scale degrees relative to the song's
+key ("I V VIm IV"), so the same progression matches in any key.
+
+Re-indexing a folder only re-parses files whose size or mtime changed
+and whose content hash differs from the indexed one; files that
+disappeared are dropped from the index.
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple
+
+from lib.cifra_logic import (
+    get_content_from_file, song_to_bytes, song_from_bytes, song_digest,
+    tokenize_chord, get_note_index, split_note,
+)
+
+SearchResult = namedtuple('SearchResult', ['source', 'title', 'artist', 'key', 'score'])
+IndexStats = namedtuple('IndexStats', ['added', 'updated', 'unchanged', 'removed', 'errors'])
+
+DEFAULT_SEARCH_LIMIT = 20
+
+# Version of the stored rows (songs.data is lib.songpack); a library
+# written with another version is emptied when opened and re-indexed.
+LIBRARY_VERSION = 1
+
+# Degree names by semitones above the tonic; flats only, since FTS
+# tokenization would drop a '#'.
+DEGREES = ['I', 'bII', 'II', 'bIII', 'III', 'IV', 'bV', 'V', 'bVI', 'VI', 'bVII', 'VII']
+_DEGREE_INDEX = {name.lower(): i for i, name in enumerate(DEGREES)}
+_DEGREE_RE = re.compile(r'^(b?(?:iii|ii|iv|i|vii|vi|v))(m|dim)?$', re.I)
+_WORD_RE = re.compile(r'\w+')
+
+def chord_quality(suffix):
+    if suffix.startswith(('dim', '°', 'º')):
+        return 'dim'
+    if suffix.startswith('m') and not suffix.startswith('maj'):
+        return 'm'
+    return ''
+
+def parse_key_note(key):
+    """(tonic index, is_minor) of a "Tom: Em" label; tonic is -1 if unknown."""
+    note, suffix = split_note(key.replace('Tom:', '').strip())
+    return get_note_index(note), chord_quality(suffix) == 'm'
+
+def song_chords(song):
+    for line in song.lines:
+        if line.is_chord and not line.is_header:
+            for text in line.text.split():
+                token = tokenize_chord(text)
+                if token.root != -1:
+                    yield token
+
+def song_progression(song, tonic=-1):
+    """Chords of `song` as degrees of `tonic`, repeated chords collapsed.
+
+    Without a known tonic the first chord is taken as the tonic.
+    """
+    progression = []
+    for token in song_chords(song):
+        if tonic == -1:
+            tonic = token.root
+        degree = DEGREES[(token.root - tonic) % 12] + chord_quality(token.suffix)
+        if not progression or progression[-1] != degree:
+            progression.append(degree)
+    return progression
+
+def normalize_progression(text):
+    """Degree tokens of a progression query ("I V vi IV" -> I V VIm IV).
+
+    Lower-case numerals are minor chords, as in the usual notation.
+    """
+    degrees = []
+    for word in text.replace('-', ' ').split():
+        match = _DEGREE_RE.match(word)
+        if match is None:
+            raise ValueError(f"Grau inválido na progressão: {word}")
+        numeral, quality = match.group(1), (match.group(2) or '').lower()
+        if not quality and numeral.lstrip('b').islower():
+            quality = 'm'
+        degrees.append(DEGREES[_DEGREE_INDEX[numeral.lower()]] + quality)
+    return degrees
+
+def song_lyrics(song):
+    return "\n".join(line.stripped for line in song.lines
+                     if line.stripped and not line.is_chord and not line.is_header)
+
+def fts_query(text):
+    """FTS5 query matching every word of `text`, the last one as a prefix."""
+    words = _WORD_RE.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+class Library:
+    """SQLite-backed song index; safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS songs ("
+                "id INTEGER PRIMARY KEY, source TEXT UNIQUE NOT NULL, "
+                "title TEXT NOT NULL, artist TEXT NOT NULL, key TEXT NOT NULL, "
+                "tonic INTEGER NOT NULL, minor INTEGER NOT NULL, "
+                "digest TEXT NOT NULL, mtime REAL, size INTEGER, "
+                "data BLOB NOT NULL, indexed_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS songs_key ON songs(tonic, minor);"
+                "CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5("
+                "title, artist, lyrics, progression, tokenize='unicode61 remove_diacritics 2');"
+            )
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != LIBRARY_VERSION:
+                self._conn.executescript(
+                    "DELETE FROM songs; DELETE FROM songs_fts;"
+                    f"PRAGMA user_version = {LIBRARY_VERSION};"
+                )
+            self._pid = os.getpid()
+        return self._conn
+
+    def _upsert(self, conn, source, song, digest, mtime=None, size=None):
+        tonic, minor = parse_key_note(song.key) if song.key else (-1, False)
+        progression = ' '.join(song_progression(song, tonic))
+        row = conn.execute("SELECT id FROM songs WHERE source = ?", (source,)).fetchone()
+        values = (song.title, song.artist, song.key, tonic, int(minor), digest, mtime, size,
+                  song_to_bytes(song), time.time())
+        if row is None:
+            song_id = conn.execute(
+                "INSERT INTO songs (title, artist, key, tonic, minor, digest, mtime, size, data, indexed_at, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values + (source,),
+            ).lastrowid
+        else:
+            song_id = row[0]
+            conn.execute(
+                "UPDATE songs SET title = ?, artist = ?, key = ?, tonic = ?, minor = ?, digest = ?, "
+                "mtime = ?, size = ?, data = ?, indexed_at = ? WHERE id = ?", values + (song_id,),
+            )
+            conn.execute("DELETE FROM songs_fts WHERE rowid = ?", (song_id,))
+        conn.execute(
+            "INSERT INTO songs_fts (rowid, title, artist, lyrics, progression) VALUES (?, ?, ?, ?, ?)",
+            (song_id, song.title, song.artist, song_lyrics(song), progression),
+        )
+        return row is None
+
+    def _delete(self, conn, source):
+        row = conn.execute("SELECT id FROM songs WHERE source = ?", (source,)).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM songs_fts WHERE rowid = ?", (row[0],))
+            conn.execute("DELETE FROM songs WHERE id = ?", (row[0],))
+
+    def add_song(self, source, song):
+        """Index a song (e.g. scraped, keyed by its URL); False if unchanged."""
+        digest = song_digest(song)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT digest FROM songs WHERE source = ?", (source,)).fetchone()
+            if row is not None and row[0] == digest:
+                return False
+            self._upsert(conn, source, song, digest)
+            conn.commit()
+        return True
+
+    def remove(self, source):
+        with self._lock:
+            conn = self._connection()
+            self._delete(conn, source)
+            conn.commit()
+
+    def index_directory(self, root):
+        """Index every .txt under `root`, re-parsing only changed files."""
+        root = os.path.abspath(root)
+        added = updated = unchanged = removed = errors = 0
+        with self._lock:
+            conn = self._connection()
+            prefix = root.rstrip(os.sep) + os.sep
+            known = {
+                source: (mtime, size, digest)
+                for source, mtime, size, digest in conn.execute(
+                    "SELECT source, mtime, size, digest FROM songs WHERE substr(source, 1, ?) = ?",
+                    (len(prefix), prefix),
+                )
+            }
+            seen = set()
+            for dirpath, _, filenames in os.walk(root):
+                for filename in sorted(filenames):
+                    if not filename.lower().endswith('.txt'):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    seen.add(path)
+                    try:
+                        stat = os.stat(path)
+                        previous = known.get(path)
+                        if previous is not None and previous[:2] == (stat.st_mtime, stat.st_size):
+                            unchanged += 1
+                            continue
+                        with open(path, 'rb') as f:
+                            digest = hashlib.sha256(f.read()).hexdigest()
+                        if previous is not None and previous[2] == digest:
+                            # Touched but not edited: just remember the new stat
+                            conn.execute("UPDATE songs SET mtime = ?, size = ? WHERE source = ?",
+                                         (stat.st_mtime, stat.st_size, path))
+                            unchanged += 1
+                            continue
+                        song = get_content_from_file(path)
+                        if self._upsert(conn, path, song, digest, stat.st_mtime, stat.st_size):
+                            added += 1
+                        else:
+                            updated += 1
+                    except Exception as e:
+                        print(f"Erro ao indexar {path}: {e}", file=sys.stderr)
+                        errors += 1
+            for source in known.keys() - seen:
+                self._delete(conn, source)
+                removed += 1
+            conn.commit()
+        return IndexStats(added, updated, unchanged, removed, errors)
+
+    def get(self, source):
+        """The indexed Song for `source`, or None."""
+        with self._lock:
+            row = self._connection().execute("SELECT data FROM songs WHERE source = ?", (source,)).fetchone()
+        return song_from_bytes(row[0]) if row is not None else None
+
+    def search(self, query='', progression=None, key=None, limit=DEFAULT_SEARCH_LIMIT):
+        """Best matches for words in title/artist/lyrics, ranked by bm25.
+
+        `progression` ("I V vi IV") must appear in order in the song's
+        chords; `key` ("G", "Em") restricts results to songs in that key.
+        """
+        clauses = []
+        match = fts_query(query or '')
+        if match:
+            clauses.append(f'{{title artist lyrics}} : ({match})')
+        if progression:
+            degrees = normalize_progression(progression)
+            if degrees:
+                clauses.append(f'progression : "{" ".join(degrees)}"')
+
+        conditions = []
+        params = []
+        if clauses:
+            conditions.append("songs_fts MATCH ?")
+            params.append(' AND '.join(clauses))
+        if key:
+            tonic, minor = parse_key_note(key)
+            if tonic == -1:
+                raise ValueError(f"Tom inválido: {key}")
+            conditions.append("s.tonic = ? AND s.minor = ?")
+            params.extend([tonic, int(minor)])
+
+        if clauses:
+            sql = ("SELECT s.source, s.title, s.artist, s.key, bm25(songs_fts, 10.0, 5.0, 1.0, 2.0) AS score "
+                   "FROM songs_fts JOIN songs s ON s.id = songs_fts.rowid")
+            order = "score"
+        else:
+            sql = "SELECT s.source, s.title, s.artist, s.key, 0.0 AS score FROM songs s"
+            order = "s.title"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {order} LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._connection().execute(sql, params).fetchall()
+        return [SearchResult(*row) for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+def open_library(path=None):
+    """Library at `path` or CIFRA_LIBRARY; None when neither is set."""
+    path = path or os.environ.get('CIFRA_LIBRARY')
+    return Library(path) if path else None
@@ -0,0 +1,140 @@
+"""Per-request timing spans and process-wide aggregated metrics.
+
+Pipeline stages wrap their work in `span(name)`. Every span is added to
+the process-wide registry (counts and latency histograms) and, when the
+current thread is serving a request started with start_request, to that
+request's timer so it can be sent back as a Server-Timing header.
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+SIZE_BUCKETS_BYTES = (10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 5_000_000)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def snapshot(self):
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'mean': round(self.total / self.count, 3) if self.count else 0,
+            'max': round(self.max, 3),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS_MS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {name: h.snapshot() for name, h in self.histograms.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+registry = Registry()
+
+class RequestTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, duration_ms):
+        self.spans.append((name, duration_ms))
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        """Server-Timing header value, repeated stages summed together."""
+        totals = {}
+        for name, duration_ms in self.spans:
+            totals[name] = totals.get(name, 0) + duration_ms
+        entries = [f"{name};dur={duration_ms:.1f}" for name, duration_ms in totals.items()]
+        entries.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(entries)
+
+_local = threading.local()
+
+def start_request():
+    _local.timer = RequestTimer()
+    return _local.timer
+
+def finish_request():
+    timer = getattr(_local, 'timer', None)
+    _local.timer = None
+    return timer
+
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+@contextmanager
+def attach_timer(timer):
+    """Record this thread's spans into `timer`, the request of another thread.
+
+    For helper threads working for a request (e.g. concurrent fetches);
+    their spans are summed per stage like any other.
+    """
+    previous = getattr(_local, 'timer', None)
+    _local.timer = timer
+    try:
+        yield
+    finally:
+        _local.timer = previous
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        registry.observe(f"stage.{name}", duration_ms)
+        timer = getattr(_local, 'timer', None)
+        if timer is not None:
+            timer.add(name, duration_ms)
+
+def observe_output(format_type, size):
+    registry.observe(f"output_bytes.{format_type}", size, SIZE_BUCKETS_BYTES)
+
+def with_hit_ratio(stats):
+    """Copy of cache stats ({'hits', 'misses', ...} per tier) with a hit_ratio."""
+    result = {}
+    for tier, values in stats.items():
+        lookups = values['hits'] + values['misses']
+        result[tier] = dict(values, hit_ratio=round(values['hits'] / lookups, 4) if lookups else None)
+    return result
@@ -0,0 +1,12 @@
+"""Reading numeric settings from the environment."""
+import os
+
+def env_number(name, default, cast=int):
+    """`cast` of environment variable `name`; `default` when unset, empty or invalid."""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        return default
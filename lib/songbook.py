@@ -0,0 +1,147 @@
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.cifra_logic import (
+    load_cifra, get_content_from_file, transpose_song, split_song_url, get_note_index,
+    layout_song, new_pdf, draw_pdf_song, new_docx, add_docx_song, save_docx,
+    CIFRA_CLUB_KEY_MAP,
+)
+from lib.fetcher import HTTP_POOL_SIZE
+from lib.metrics import span, current_timer, attach_timer
+
+# Concurrent fetches per songbook; bounded by the HTTP connection pool so
+# workers never wait on a connection.
+MAX_FETCH_WORKERS = min(8, HTTP_POOL_SIZE)
+TOC_ENTRIES_PER_PAGE = 35
+DEFAULT_SONGBOOK_TITLE = "Repertório"
+
+SONGBOOK_FORMATS = ('pdf', 'docx')
+
+# One song of a setlist: a Cifra Club URL or a .txt path, plus the optional
+# Cifra Club key index to transpose it to.
+SetlistEntry = namedtuple('SetlistEntry', ['source', 'target_key_index'])
+
+_KEY_NOTE_RE = re.compile(r'^[A-G][#b]?m?$')
+
+# Chromatic index -> Cifra Club key index
+_CIFRA_CLUB_INDEX = {chromatic: index for index, chromatic in CIFRA_CLUB_KEY_MAP.items()}
+
+def key_index_from_text(text):
+    """Cifra Club key index from "5" (an index) or a note like "Bb"/"F#m"."""
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+    if not _KEY_NOTE_RE.match(text):
+        raise ValueError(f"Tom inválido: {text}")
+    root = text[:-1] if text.endswith('m') else text
+    return _CIFRA_CLUB_INDEX[get_note_index(root)]
+
+def parse_setlist_line(line):
+    """Parse one setlist line into a SetlistEntry, or None for blanks/comments.
+
+    Accepted forms (the key is optional):
+        https://www.cifraclub.com.br/artista/musica/#key=5
+        https://www.cifraclub.com.br/artista/musica/ G
+        charts/minha musica.txt | Bb
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    source, key_text = line, None
+    if '|' in line:
+        source, key_text = [part.strip() for part in line.rsplit('|', 1)]
+    else:
+        parts = line.rsplit(None, 1)
+        if len(parts) == 2 and (_KEY_NOTE_RE.match(parts[1]) or parts[1].isdigit()):
+            source, key_text = parts
+
+    target_key_index = None
+    if source.startswith(('http://', 'https://')):
+        source, target_key_index = split_song_url(source)
+    if key_text:
+        target_key_index = key_index_from_text(key_text)
+    return SetlistEntry(source, target_key_index)
+
+def read_setlist(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = [parse_setlist_line(line) for line in f]
+    except OSError as e:
+        raise Exception(f"Erro ao ler o repertório: {e}")
+    return [entry for entry in entries if entry is not None]
+
+def load_entry(entry):
+    if os.path.isfile(entry.source):
+        song = get_content_from_file(entry.source)
+    else:
+        song = load_cifra(entry.source)
+    return transpose_song(song, entry.target_key_index)
+
+def load_songs(entries, max_workers=MAX_FETCH_WORKERS):
+    """Fetch/parse every entry concurrently, keeping the setlist order."""
+    # Pool threads report their fetch/parse/transpose spans to the request
+    timer = current_timer()
+
+    def load(entry):
+        try:
+            with attach_timer(timer):
+                return load_entry(entry)
+        except Exception as e:
+            raise Exception(f"Erro em {entry.source}: {e}")
+
+    if len(entries) <= 1:
+        return [load(entry) for entry in entries]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(entries))) as executor:
+        return list(executor.map(load, entries))
+
+def _song_label(song):
+    return f"{song.title} - {song.artist}"
+
+def _pdf_toc_renderer(title):
+    def render_toc(pdf, outline):
+        pdf.set_font('Helvetica', 'BU', 14)
+        pdf.cell(0, 8, title, new_x="LMARGIN", new_y="NEXT", align='C')
+        pdf.ln(4)
+        pdf.set_font('Helvetica', '', 11)
+        for number, section in enumerate(outline, 1):
+            link = pdf.add_link(page=section.page_number)
+            pdf.cell(180, 7, f"{number}. {section.name}", link=link)
+            pdf.cell(0, 7, str(section.page_number), align='R', link=link, new_x="LMARGIN", new_y="NEXT")
+    return render_toc
+
+def render_songbook_pdf(songs, title=DEFAULT_SONGBOOK_TITLE, stream=None):
+    pdf = new_pdf()
+    pdf.add_page()
+    toc_pages = max(1, -(-len(songs) // TOC_ENTRIES_PER_PAGE))
+    pdf.insert_toc_placeholder(_pdf_toc_renderer(title), pages=toc_pages, reset_page_indices=False)
+    # The placeholder already breaks to a fresh page for the first song
+    for number, song in enumerate(songs):
+        if number:
+            pdf.add_page()
+        # Outline sections feed both the table of contents and the bookmarks
+        pdf.start_section(_song_label(song))
+        draw_pdf_song(pdf, layout_song(*song))
+    return pdf.output(stream)
+
+def render_songbook_docx(songs, title=DEFAULT_SONGBOOK_TITLE, stream=None):
+    doc = new_docx()
+    doc.add_paragraph(title, 'Titulo')
+    for number, song in enumerate(songs, 1):
+        doc.add_paragraph(f"{number}. {_song_label(song)}", 'Indice')
+
+    for song in songs:
+        doc.add_page_break()
+        add_docx_song(doc, layout_song(*song))
+    return save_docx(doc, stream)
+
+def render_songbook(songs, format_type='pdf', title=DEFAULT_SONGBOOK_TITLE, stream=None):
+    """Songbook bytes, or None after writing them into `stream` if given."""
+    if format_type not in SONGBOOK_FORMATS:
+        raise ValueError(f"Formato inválido: {format_type}")
+    with span('render'):
+        if format_type == 'pdf':
+            return render_songbook_pdf(songs, title, stream)
+        return render_songbook_docx(songs, title, stream)
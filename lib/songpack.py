@@ -0,0 +1,157 @@
+"""Compact binary form of a parsed song.
+
+Used wherever a song leaves the process: the disk song cache, the hand-off
+to render workers, the library and /api/song. Every distinct string (title,
+chord line, lyric line...) is stored once in a UTF-8 string table, and
+each segment is a single uint32 holding its string index and style bits,
+so repeated choruses and chord lines cost 4 bytes each.
+
+Layout, all integers little-endian uint32:
+
+    header      magic b'CFS1', string_count, text_bytes,
+                line_count, segment_count, field_count
+    strings     string_count + 1 byte offsets into the text
+    fields      field_count string indices: title, artist, key, extras
+                (NONE for a missing extra)
+    lines       line_count + 1 offsets into the segments
+    segments    string_index << 2 | italic << 1 | bold
+    text        the UTF-8 string table
+
+SongView reads it in place from bytes or a memoryview: the integer
+arrays are a cast of the buffer and strings are decoded on first access.
+"""
+import sys
+import struct
+from array import array
+
+MAGIC = b'CFS1'
+HEADER = struct.Struct('<4sIIIII')
+NONE = 0xFFFFFFFF
+BOLD = 1
+ITALIC = 2
+SONG_FIELDS = 3  # title, artist, key
+
+def encode_song(song, extra=()):
+    """Pack `song` (title, artist, key, lines of styled segments) into bytes.
+
+    `extra` is a tuple of optional strings stored alongside it (e.g. the
+    HTTP validators of a cached page), read back as SongView.extra.
+    """
+    index = {}
+    strings = []
+
+    def intern(text):
+        position = index.get(text)
+        if position is None:
+            position = index[text] = len(strings)
+            strings.append(text.encode('utf-8'))
+        return position
+
+    fields = [intern(song.title), intern(song.artist), intern(song.key)]
+    fields.extend(NONE if value is None else intern(value) for value in extra)
+
+    line_offsets = [0]
+    segments = []
+    for line in song.lines:
+        for segment in line.segments:
+            segments.append(intern(segment.text) << 2
+                            | (ITALIC if segment.italic else 0) | (BOLD if segment.bold else 0))
+        line_offsets.append(len(segments))
+
+    string_offsets = [0]
+    total = 0
+    for encoded in strings:
+        total += len(encoded)
+        string_offsets.append(total)
+
+    numbers = array('I', string_offsets)
+    numbers.extend(fields)
+    numbers.extend(line_offsets)
+    numbers.extend(segments)
+    if sys.byteorder != 'little':
+        numbers.byteswap()
+    header = HEADER.pack(MAGIC, len(strings), total, len(line_offsets) - 1, len(segments), len(fields))
+    return b''.join((header, numbers.tobytes(), *strings))
+
+class SongView:
+    """Read-only access to an encoded song without unpacking all of it."""
+
+    __slots__ = ('_strings', '_fields', '_lines', '_segments', '_text', '_decoded')
+
+    def __init__(self, data):
+        buffer = memoryview(data).cast('B')
+        if len(buffer) < HEADER.size:
+            raise ValueError("Música codificada inválida: dados incompletos")
+        magic, string_count, text_bytes, line_count, segment_count, field_count = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError("Música codificada inválida: formato desconhecido")
+        count = (string_count + 1) + field_count + (line_count + 1) + segment_count
+        end = HEADER.size + 4 * count
+        if len(buffer) != end + text_bytes:
+            raise ValueError("Música codificada inválida: tamanho incorreto")
+
+        if sys.byteorder == 'little':
+            numbers = buffer[HEADER.size:end].cast('I')
+        else:
+            numbers = array('I', buffer[HEADER.size:end])
+            numbers.byteswap()
+        position = string_count + 1
+        self._strings = numbers[:position]
+        self._fields = numbers[position:position + field_count]
+        position += field_count
+        self._lines = numbers[position:position + line_count + 1]
+        self._segments = numbers[position + line_count + 1:]
+        self._text = buffer[end:]
+        self._decoded = [None] * string_count
+
+    def string(self, position):
+        value = self._decoded[position]
+        if value is None:
+            value = self._decoded[position] = str(
+                self._text[self._strings[position]:self._strings[position + 1]], 'utf-8')
+        return value
+
+    def _field(self, position):
+        value = self._fields[position]
+        return None if value == NONE else self.string(value)
+
+    @property
+    def title(self):
+        return self._field(0)
+
+    @property
+    def artist(self):
+        return self._field(1)
+
+    @property
+    def key(self):
+        return self._field(2)
+
+    @property
+    def extra(self):
+        return tuple(self._field(i) for i in range(SONG_FIELDS, len(self._fields)))
+
+    def __len__(self):
+        return len(self._lines) - 1
+
+    def segment(self, value):
+        """(text, bold, italic) of a packed segment value."""
+        return self.string(value >> 2), bool(value & BOLD), bool(value & ITALIC)
+
+    def packed_line(self, line):
+        """Packed segment values of line number `line`; equal lines compare equal."""
+        return tuple(self._segments[self._lines[line]:self._lines[line + 1]])
+
+    def packed_lines(self):
+        """packed_line of every line, in order."""
+        values = self._segments.tolist()
+        offsets = self._lines.tolist()
+        return [tuple(values[start:end]) for start, end in zip(offsets, offsets[1:])]
+
+    def segments(self, line):
+        """(text, bold, italic) tuples of line number `line`."""
+        return [self.segment(value) for value in self.packed_line(line)]
+
+    def lines(self):
+        for line in range(len(self)):
+            yield self.segments(line)
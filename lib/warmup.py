@@ -0,0 +1,239 @@
+"""Cache warm-up for the songs most people ask for.
+
+Targets (song URL, Cifra Club key index, format) come from a popularity
+list in setlist syntax or from the request log the API appends to. Warming
+revalidates each song in the song cache (a cheap 304 when the page did
+not change, renewing its TTL) and renders it in every requested key and
+format into the render cache, so the first request of the spike is a hit.
+
+The render cache lives in the memory of the process that renders, so the
+warm-up has to run inside the API (the background thread) or go through
+it (warm_remote, which also fills the edge cache). Run locally, it only
+fills the disk song cache (CIFRA_CACHE_DIR).
+"""
+import os
+import sys
+import time
+import threading
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from lib.cifra_logic import refresh_cifra, render_song, split_song_url, RENDERERS
+from lib.cache import normalize_song_url
+from lib.fetcher import get_session, CONNECT_TIMEOUT
+from lib.songbook import parse_setlist_line, MAX_FETCH_WORKERS
+from lib.settings import env_number
+
+# One document to have ready: key index None is the original key.
+WarmTarget = namedtuple('WarmTarget', ['url', 'target_key_index', 'format'])
+WarmStats = namedtuple('WarmStats', ['songs', 'documents', 'failed', 'elapsed'])
+
+DEFAULT_WARM_FORMATS = ('pdf',)
+DEFAULT_WARM_TOP = 50
+DEFAULT_LOG_WINDOW = 7 * 24 * 3600    # seconds of request log considered
+REMOTE_READ_TIMEOUT = 30
+
+# Serializes appends with the rewrite in read_request_log, so a request
+# recorded while the log is being trimmed is not lost.
+_log_lock = threading.Lock()
+
+class RequestLog:
+    """Log of generated documents, one tab-separated line each.
+
+    Lines are appended as requests come in; read_request_log drops the ones
+    older than its window, so the file holds about one window of traffic.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, url, target_key_index, format_type):
+        key = '' if target_key_index is None else target_key_index
+        line = f"{time.time():.0f}\t{normalize_song_url(url)}\t{key}\t{format_type}\n"
+        try:
+            with _log_lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            print(f"WARN: could not write request log: {e}", file=sys.stderr)
+
+def open_request_log(path=None):
+    """RequestLog at `path` or CIFRA_REQUEST_LOG; None when neither is set."""
+    path = path or os.environ.get('CIFRA_REQUEST_LOG')
+    return RequestLog(path) if path else None
+
+def _parse_log_line(line, since):
+    """WarmTarget of a request log line, None if it is invalid or older than `since`."""
+    parts = line.rstrip('\n').split('\t')
+    if len(parts) != 4:
+        return None
+    timestamp, url, key, format_type = parts
+    try:
+        if float(timestamp) < since:
+            return None
+        target_key_index = int(key) if key else None
+    except ValueError:
+        return None
+    if format_type not in RENDERERS and format_type != 'zip':
+        return None
+    return WarmTarget(url, target_key_index, format_type)
+
+def read_request_log(path, window=DEFAULT_LOG_WINDOW):
+    """Counter of WarmTargets requested in the last `window` seconds.
+
+    With a window, the file is rewritten without the lines outside it.
+    """
+    since = time.time() - window if window else 0
+    counts = Counter()
+    kept = []
+    dropped = 0
+    with _log_lock:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                target = _parse_log_line(line, since)
+                if target is None:
+                    dropped += 1
+                    continue
+                counts[target] += 1
+                kept.append(line)
+        if window and dropped:
+            _rewrite_log(path, kept)
+    return counts
+
+def _rewrite_log(path, lines):
+    # Written aside and renamed, like the batch manifest, so it is never torn
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"WARN: could not trim request log: {e}", file=sys.stderr)
+
+def popular_targets(log_path, top=DEFAULT_WARM_TOP, window=DEFAULT_LOG_WINDOW):
+    return [target for target, _ in read_request_log(log_path, window).most_common(top)]
+
+def read_popularity_list(path, formats=DEFAULT_WARM_FORMATS):
+    """Targets from a setlist-style file ("url [key]" per line), in every format."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = [parse_setlist_line(line) for line in f]
+    except OSError as e:
+        raise Exception(f"Erro ao ler a lista de músicas: {e}")
+    return [
+        WarmTarget(entry.source, entry.target_key_index, format_type)
+        for entry in entries
+        if entry is not None and entry.source.startswith(('http://', 'https://'))
+        for format_type in formats
+    ]
+
+def _group_by_song(targets):
+    songs = {}
+    for target in targets:
+        songs.setdefault(normalize_song_url(target.url), []).append(target)
+    return songs
+
+def warm(targets, max_workers=MAX_FETCH_WORKERS, progress=None):
+    """Refresh each song once, then render all of its targets in this process."""
+    start = time.perf_counter()
+    songs = _group_by_song(targets)
+
+    def warm_song(song_targets):
+        try:
+            song = refresh_cifra(song_targets[0].url)
+        except Exception as e:
+            return 0, len(song_targets), f"{song_targets[0].url}: {e}"
+        documents = failed = 0
+        error = None
+        for target in song_targets:
+            try:
+                render_song(song, target.target_key_index, target.format)
+                documents += 1
+            except Exception as e:
+                failed += 1
+                error = f"{target.url} ({target.format}): {e}"
+        return documents, failed, error
+
+    return _run(warm_song, songs, max_workers, progress, start)
+
+def warm_remote(targets, server, max_workers=MAX_FETCH_WORKERS, progress=None):
+    """Request each target from a running API (and its edge cache) at `server`."""
+    start = time.perf_counter()
+    songs = _group_by_song(targets)
+    session = get_session()
+    endpoint = server.rstrip('/') + '/api/generate'
+
+    def warm_song(song_targets):
+        documents = failed = 0
+        error = None
+        for target in song_targets:
+            url = target.url
+            if target.target_key_index is not None:
+                url = f"{split_song_url(url)[0]}#key={target.target_key_index}"
+            try:
+                response = session.get(
+                    f"{endpoint}?{urlencode({'url': url, 'format': target.format})}",
+                    timeout=(CONNECT_TIMEOUT, REMOTE_READ_TIMEOUT),
+                )
+                response.raise_for_status()
+                documents += 1
+            except Exception as e:
+                failed += 1
+                error = f"{url}: {e}"
+        return documents, failed, error
+
+    return _run(warm_song, songs, max_workers, progress, start)
+
+def _run(warm_song, songs, max_workers, progress, start):
+    documents = failed = 0
+    workers = max(1, min(max_workers, len(songs)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cifra-warmup') as executor:
+        for done, (song_documents, song_failed, error) in enumerate(executor.map(warm_song, songs.values()), 1):
+            documents += song_documents
+            failed += song_failed
+            if progress is not None:
+                progress(f"[{done}/{len(songs)}] " + (f"Erro em {error}" if error else "ok"))
+    return WarmStats(len(songs), documents, failed, time.perf_counter() - start)
+
+def warmup_targets_from_env():
+    """Targets for the API's warm-up thread.
+
+    CIFRA_WARMUP_LIST       popularity list in setlist syntax
+    CIFRA_WARMUP_FORMATS    comma-separated formats for the list (default pdf)
+    CIFRA_REQUEST_LOG       request log; its CIFRA_WARMUP_TOP (default 50)
+                            most requested documents of the last week
+    """
+    targets = []
+    list_path = os.environ.get('CIFRA_WARMUP_LIST')
+    if list_path:
+        formats = [f for f in os.environ.get('CIFRA_WARMUP_FORMATS', 'pdf').split(',') if f]
+        targets.extend(read_popularity_list(list_path, formats))
+    log_path = os.environ.get('CIFRA_REQUEST_LOG')
+    if log_path and os.path.exists(log_path):
+        top = env_number('CIFRA_WARMUP_TOP', DEFAULT_WARM_TOP)
+        targets.extend(popular_targets(log_path, top))
+    return list(dict.fromkeys(targets))
+
+def start_warmup_thread():
+    """Warm the caches in the background when CIFRA_WARMUP_INTERVAL is set.
+
+    The first pass runs right away; later ones every CIFRA_WARMUP_INTERVAL
+    seconds, keeping the songs revalidated inside the cache TTL.
+    """
+    interval = env_number('CIFRA_WARMUP_INTERVAL', 0, float)
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            try:
+                stats = warm(warmup_targets_from_env())
+                print(f"Warm-up: {stats.documents} documents from {stats.songs} songs "
+                      f"({stats.failed} failed) in {stats.elapsed:.1f}s", file=sys.stderr)
+            except Exception as e:
+                print(f"WARN: warm-up failed: {e}", file=sys.stderr)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='cifra-warmup', daemon=True)
+    thread.start()
+    return thread
@@ -24,10 +24,7 @@ try:
     print("-" * 20)
     print("First 10 lines of content:")
     for line in lines[:10]:
-        text = ""
-        for seg in line:
-            text += seg['text']
-        print(text)
+        print(line.text)
 except Exception as e:
     print(f"Error: {e}")
     import traceback